@@ -1,42 +0,0 @@
-# 時間割を自動的に生成するためのバッチ処理スクリプト
-
-rooms = [i for i in range(10)]
-avails = [
-    [(0, 3), (0, 5), (3, 1), (3, 2), (4, 1),
-     (4, 2), (4, 5), (5, 1), (5, 3)],  # 教室1
-    [(0, 5), (1, 1), (1, 3), (1, 4), (1, 5), (2, 3), (3, 1), (3, 2),
-     (3, 3), (3, 4), (4, 1), (4, 5), (5, 1), (5, 2), (5, 3)],  # 教室2
-    [(0, 1), (0, 3), (1, 1), (2, 2), (2, 3), (2, 5), (3, 1),
-     (3, 3), (3, 4), (4, 1), (4, 2), (4, 5), (5, 2), (5, 3)],  # 教室3
-    [(0, 3), (0, 4), (0, 5), (1, 1), (1, 2), (1, 3), (1, 4),  (2, 1), (2, 2), (2, 3), (3, 1), (3, 2),
-     (3, 3),  (3, 5), (4, 1), (4, 2), (4, 3), (4, 4), (4, 5), (5, 1), (5, 2), (5, 3)],  # 教室4
-    [(0, 1),  (0, 3), (0, 5), (1, 1), (1, 2), (1, 3), (1, 4), (1, 5), (2, 1), (2, 2), (2, 3), (2, 4), (3, 1), (3, 2),
-     (3, 3), (3, 4), (3, 5), (4, 1), (4, 2), (4, 3), (4, 4), (4, 5), (5, 1), (5, 2), (5, 3)],  # 教室5
-    [(0, 1), (0, 2), (0, 3), (0, 4), (1, 1), (1, 2), (1, 3), (2, 1), (2, 2), (2, 3), (2, 4), (3, 1), (3, 2),
-     (3, 3), (3, 5), (4, 1), (4, 2), (4, 3), (4, 5), (5, 1), (5, 2), (5, 3)],  # 教室6
-    [(0, 1), (0, 2), (0, 3), (0, 4), (0, 5), (1, 1), (1, 2), (1, 3), (1, 4), (1, 5), (2, 1), (2, 2), (2, 3), (2, 4), (2, 5), (3, 1), (3, 2),
-     (3, 3), (3, 4), (3, 5), (4, 1), (4, 2), (4, 3), (4, 4), (4, 5), (5, 1), (5, 2), (5, 3)],  # 教室6
-    [(0, 1),  (0, 3),  (0, 5),  (1, 4), (2, 1),  (2, 4), (2, 5), (3, 1), (3, 2),
-     (3, 3), (3, 5), (4, 1), (4, 4), (4, 5), (5, 1), ],  # 教室7
-    [(0, 1),  (1, 1),  (1, 3), (1, 4), (2, 1), (3, 1),
-     (3, 5), (4, 2),  (4, 5), (5, 1), (5, 3)],  # 教室8
-    [(0, 1), (0, 2), (0, 3), (0, 4), (0, 5), (1, 1),  (1, 3),  (1, 5), (2, 1), (2, 2), (2, 3), (2, 4), (2, 5), (3, 1), (3, 2),
-     (3, 3), (3, 4), (3, 5), (4, 1), (4, 2), (4, 3), (4, 4), (4, 5), (5, 1), (5, 2), (5, 3)]  # 教室9
-]
-f = open("fixture/units.json", "w")
-
-f.write("[\n")
-pk = 0
-for room in rooms:
-    for weekday, period in avails[room]:
-        f.write("    {\n")
-        f.write("        \"model\": \"room.unit\",\n")
-        f.write("        \"pk\": " + str(pk) + ",\n")
-        pk += 1
-        f.write("        \"fields\": {\n")
-        f.write("            \"room\": " + str(room) + ",\n")
-        f.write("            \"weekday\": " + str(weekday) + ",\n")
-        f.write("            \"period\": " + str(period) + "\n")
-        f.write("        }\n")
-        f.write("    },\n")
-f.write("]\n")
@@ -1,3 +1,16 @@
 from django.contrib import admin
 
+from .models import BookingPhase, Term
+
 # Register your models here.
+
+
+class BookingPhaseInline(admin.TabularInline):
+    model = BookingPhase
+    extra = 0
+
+
+@admin.register(Term)
+class TermAdmin(admin.ModelAdmin):
+    list_display = ('name', 'first_date', 'last_date')
+    inlines = [BookingPhaseInline]
@@ -3,3 +3,6 @@ from django.apps import AppConfig
 
 class RoomConfig(AppConfig):
     name = 'room'
+
+    def ready(self):
+        from . import signals  # noqa: F401
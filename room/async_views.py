@@ -0,0 +1,133 @@
+import datetime
+
+from asgiref.sync import sync_to_async
+from django.contrib.auth.views import redirect_to_login
+from django.db import close_old_connections
+from django.http import Http404
+from django.shortcuts import render
+from django.utils.safestring import mark_safe
+
+from . import cache, roles
+from .views import (build_calendar, build_unit, get_date,
+                    get_day_grid, overlay_day_grid)
+from .windows import is_available
+
+# Calendar・ScheduleInDay・RoomsInUnit の ASGI 版（ROOM_ASYNC_VIEWS が有効なときに使う）。
+# Django 3.1 の ORM は同期のみなので、問い合わせはスレッドプールで走らせ、
+# 待っている間イベントループは他のリクエストを処理する。
+# 同期版の LoginRequiredMixin と同じく、ログインを確かめてから予約状況を組み立てる。
+# 書き込みのあるビューは同期のまま。
+
+
+async def run(function, *args):
+    """ function をスレッドプールで実行する。使った DB 接続は CONN_MAX_AGE に従って片付ける """
+    def call():
+        try:
+            return function(*args)
+        finally:
+            close_old_connections()
+    return await sync_to_async(call, thread_sensitive=False)()
+
+
+def load_user(request):
+    # request.user は初めて触れたときにセッションとユーザを読むので、
+    # 管理者の判定と合わせてスレッドの中で済ませておく
+    user = request.user
+    roles.is_admin(request)
+    return user
+
+
+def cached(prefix, dates, parts, build):
+    key = cache.versioned_key(prefix, dates, *parts)
+    return cache.get_or_build(key, build)
+
+
+async def url_date(year, month, day):
+    # 年を省いた URL は予約期間の表（DB）から今の学期の年を引くので、スレッドの中で求める
+    if year:
+        return get_date(year, month, day)
+    return await run(get_date, year, month, day)
+
+
+async def respond(request, template_name, context):
+    return await sync_to_async(render, thread_sensitive=False)(
+        request, template_name, context)
+
+
+async def calendar(request, year=None, month=None, day=None):
+    user = await run(load_user, request)
+    if not user.is_authenticated:
+        return redirect_to_login(request.get_full_path())
+
+    today = datetime.date.today()
+    if month and day:
+        base_date = await url_date(year, month, day)
+    else:
+        base_date = today
+    days = [base_date + datetime.timedelta(days=day) for day in range(7)]
+    calendar = await run(cached, 'calendar', days, (days[0], today),
+                         lambda: build_calendar(days, today))
+
+    return await respond(request, 'room/calendar.html', {
+        'calendar': calendar,
+        'days': days,
+        'start_day': days[0],
+        'end_day': days[-1],
+        'before': days[0] - datetime.timedelta(days=7),
+        'next': days[-1] + datetime.timedelta(days=1),
+        'today': today,
+    })
+
+
+async def schedule_in_day(request, month, day, year=None):
+    user = await run(load_user, request)
+    if not user.is_authenticated:
+        return redirect_to_login(request.get_full_path())
+
+    date = await url_date(year, month, day)
+    today = datetime.date.today()
+    is_admin = roles.is_admin(request)
+
+    def day_grid():
+        # 予約期間の表は読み込み直すことがあるので、スレッドの中で引く
+        is_open = is_available(date) and date > today
+        return is_open, get_day_grid(date, is_admin, is_open)
+
+    is_open, grid = await run(day_grid)
+    if is_admin:
+        grid = mark_safe(grid['html'])
+    else:
+        grid = overlay_day_grid(grid, user.id)
+    return await respond(request, 'room/day.html', {
+        'grid': grid,
+        'date': date,
+        'today': today,
+        'is_available': is_open,
+    })
+
+
+async def rooms_in_unit(request, month, day, period, year=None):
+    user = await run(load_user, request)
+    if not user.is_authenticated:
+        return redirect_to_login(request.get_full_path())
+
+    date = await url_date(year, month, day)
+    today = datetime.date.today()
+    is_admin = roles.is_admin(request)
+
+    def build():
+        # 管理者しか見られない日付は、権限を確かめてから組み立てる
+        if not is_admin and (date <= today or not is_available(date)):
+            raise Http404
+        return cached('unit', [date], (date, period, today),
+                      lambda: build_unit(date, period))
+
+    payload = await run(build)
+
+    context = dict(payload)
+    context['month'] = month
+    context['day'] = day
+    context['date'] = date
+    context['today'] = today
+    context['period'] = period
+    return await respond(request, 'room/unit.html', context)
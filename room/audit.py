@@ -0,0 +1,231 @@
+import atexit
+import json
+import logging
+import os
+import threading
+
+from django.conf import settings
+from django.db import DatabaseError, IntegrityError, connection, transaction
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
+
+from .models import Log
+
+logger = logging.getLogger(__name__)
+
+SPOOL_FIELDS = ('user_id', 'type', 'unit_id', 'faculty', 'course',
+                'num_students')
+
+
+def record(user, type, schedule):
+    """ 予約の操作ログを残す。
+
+    ROOM_AUDIT_ASYNC が有効なら、トランザクションのコミット後にバッファへ積み、
+    まとめて bulk_create する。無効なら（テストなど）その場で保存する。
+    """
+    log = build_log(user, type, schedule)
+    if settings.ROOM_AUDIT_ASYNC:
+        transaction.on_commit(lambda: writer.enqueue(log))
+    else:
+        log.save()
+    return log
+
+
+def record_many(user, type, schedules):
+    """ record() の複数件版。同期モードでも1回の bulk_create で保存する """
+    logs = [build_log(user, type, schedule) for schedule in schedules]
+    if settings.ROOM_AUDIT_ASYNC:
+        transaction.on_commit(lambda: writer.enqueue(*logs))
+    else:
+        Log.objects.bulk_create(logs)
+    return logs
+
+
+def build_log(user, type, schedule):
+    log = Log()
+    log.user = user
+    log.created_at = timezone.now()
+    log.type = type
+    log.unit = schedule.unit
+    log.date = schedule.date
+    log.faculty = schedule.faculty
+    log.course = schedule.course
+    log.num_students = schedule.num_students
+    return log
+
+
+def to_spool(log):
+    row = {field: getattr(log, field) for field in SPOOL_FIELDS}
+    row['created_at'] = log.created_at.isoformat()
+    row['date'] = log.date.isoformat()
+    return json.dumps(row, ensure_ascii=False)
+
+
+def from_spool(line):
+    row = json.loads(line)
+    row['created_at'] = parse_datetime(row['created_at'])
+    row['date'] = parse_date(row['date'])
+    return Log(**row)
+
+
+class LogWriter:
+    """ Log をプロセス内のバッファに溜め、件数か時間で区切って書き込む。
+
+    DB に書けなかった分とプロセス終了時に書き残した分は ROOM_AUDIT_SPOOL に
+    JSONL で退避し、次に書き込むときに取り込み直す。消されたユーザを指すなど
+    保存できない行や読めない行は ROOM_AUDIT_DEAD_LETTER に移し、他の行の書き込みを止めない。
+    書き込み中の例外はログに残してスレッドを続け、それでも止まったら次の enqueue で起こし直す。
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.wakeup = threading.Event()
+        self.buffer = []
+        self.thread = None
+
+    def enqueue(self, *logs):
+        with self.lock:
+            self.buffer.extend(logs)
+            full = len(self.buffer) >= settings.ROOM_AUDIT_BATCH_SIZE
+            if self.thread is None:
+                atexit.register(self.shutdown)
+            if self.thread is None or not self.thread.is_alive():
+                self.thread = threading.Thread(
+                    target=self.run, name='room-audit', daemon=True)
+                self.thread.start()
+        if full:
+            self.wakeup.set()
+
+    def run(self):
+        while True:
+            self.wakeup.wait(settings.ROOM_AUDIT_FLUSH_INTERVAL)
+            self.wakeup.clear()
+            try:
+                self.flush()
+            except Exception:
+                # 退避ファイルが書けないなどで失敗しても、スレッドは止めずに次の回で書き直す
+                logger.exception('failed to flush logs')
+            finally:
+                connection.close()
+
+    def take(self):
+        with self.lock:
+            logs, self.buffer = self.buffer, []
+        return logs
+
+    def give_back(self, logs):
+        with self.lock:
+            self.buffer[:0] = logs
+
+    def flush(self):
+        claimed, spooled = self.read_spool()
+        taken = self.take()
+        logs = spooled + taken
+        if logs:
+            try:
+                with transaction.atomic():
+                    Log.objects.bulk_create(
+                        logs, batch_size=settings.ROOM_AUDIT_BATCH_SIZE)
+            except IntegrityError:
+                # 消されたユーザ・時間割を指す行があると全体が失敗するので、1件ずつ入れ直す
+                self.save_each(logs)
+            except Exception:
+                logger.exception('failed to write %d logs, spooling', len(logs))
+                try:
+                    self.write_spool(logs)
+                except OSError:
+                    # 退避もできなければ、取り込んだファイルは残し、バッファの分は戻して次の回に回す
+                    self.give_back(taken)
+                    raise
+        # 取り込んだ退避ファイルは、書き込むか退避し直してから消す
+        if claimed:
+            os.remove(claimed)
+
+    def save_each(self, logs):
+        """ 1件ずつ保存する。保存できない行は ROOM_AUDIT_DEAD_LETTER に移し、
+        DB に書けなくなったら残りを退避する """
+        failed = []
+        for i, log in enumerate(logs):
+            try:
+                with transaction.atomic():
+                    log.save()
+            except IntegrityError:
+                failed.append(log)
+            except DatabaseError:
+                logger.exception('failed to write %d logs, spooling',
+                                 len(logs) - i)
+                self.write_spool(logs[i:])
+                break
+        if failed:
+            logger.error('moved %d logs that cannot be saved to %s',
+                         len(failed), settings.ROOM_AUDIT_DEAD_LETTER)
+            self.write_spool(failed, settings.ROOM_AUDIT_DEAD_LETTER)
+
+    def shutdown(self):
+        # 終了処理中は DB に書けるとは限らないので、まず退避してから書き込む
+        logs = self.take()
+        if logs:
+            self.write_spool(logs)
+        try:
+            self.flush()
+        except Exception:
+            logger.exception('failed to flush logs on shutdown')
+
+    def write_spool(self, logs, path=None):
+        self.write_lines([to_spool(log) for log in logs], path)
+
+    def write_lines(self, lines, path=None):
+        with open(path or settings.ROOM_AUDIT_SPOOL, 'a', encoding='utf-8') as f:
+            f.write(''.join(line.rstrip('\n') + '\n' for line in lines))
+            f.flush()
+            os.fsync(f.fileno())
+
+    def read_spool(self):
+        """ 退避したログを取り込む。取り込んだファイルの名前（なければ None）とログを返す """
+        path = settings.ROOM_AUDIT_SPOOL
+        # 他のワーカーと同時に取り込まないよう、名前を変えてから読む。
+        # 前回消せなかった自分のファイルや、取り込み中に終了したプロセスのファイルが先
+        claimed = '%s.%d' % (path, os.getpid())
+        if not os.path.exists(claimed):
+            for source in self.orphans(path) + [path]:
+                try:
+                    os.replace(source, claimed)
+                    break
+                except FileNotFoundError:
+                    continue
+            else:
+                return None, []
+        logs, broken = [], []
+        with open(claimed, encoding='utf-8') as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                try:
+                    logs.append(from_spool(line))
+                except (ValueError, KeyError, TypeError):
+                    # 書き込み途中で終了したプロセスが残した、途切れた行など
+                    broken.append(line)
+        if broken:
+            logger.error('moved %d spooled lines that cannot be read to %s',
+                         len(broken), settings.ROOM_AUDIT_DEAD_LETTER)
+            self.write_lines(broken, settings.ROOM_AUDIT_DEAD_LETTER)
+        return claimed, logs
+
+    def orphans(self, path):
+        """ 取り込み中に終了したプロセスが残したファイル """
+        directory, base = os.path.split(path)
+        found = []
+        for name in os.listdir(directory or '.'):
+            suffix = name[len(base) + 1:]
+            if not name.startswith(base + '.') or not suffix.isdigit():
+                continue
+            try:
+                os.kill(int(suffix), 0)
+            except ProcessLookupError:
+                found.append(os.path.join(directory, name))
+            except PermissionError:
+                pass
+        return found
+
+
+writer = LogWriter()
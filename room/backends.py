@@ -0,0 +1,38 @@
+from allauth.account import auth_backends
+from django.conf import settings
+from django.contrib.auth import backends
+from django.core.cache import cache
+
+from . import routers
+
+# ログイン中のユーザをキャッシュから読む認証バックエンド。
+# AuthenticationMiddleware は毎リクエスト get_user() で User を1件読むので、
+# それをキャッシュに置き換える。User が保存・削除されたらキャッシュを消す（room.signals）
+
+USER_KEY = 'room:user:%s'
+
+
+class CachedUserMixin:
+
+    def get_user(self, user_id):
+        key = USER_KEY % user_id
+        user = cache.get(key)
+        if user is None:
+            # ログインした直後のユーザはまだレプリカにないかもしれない
+            with routers.primary():
+                user = super().get_user(user_id)
+            if user is not None:
+                cache.set(key, user, settings.ROOM_CACHE_TIMEOUT)
+        return user
+
+
+class ModelBackend(CachedUserMixin, backends.ModelBackend):
+    pass
+
+
+class AuthenticationBackend(CachedUserMixin, auth_backends.AuthenticationBackend):
+    pass
+
+
+def forget(user_id):
+    cache.delete(USER_KEY % user_id)
@@ -0,0 +1,109 @@
+import datetime
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+
+from . import audit, cache, events, quota
+from .models import Schedule
+
+# まとめて予約したときの日付ごとの結果
+BOOKED = 'booked'
+TAKEN = 'taken'
+CLOSED = 'closed'
+OVER_QUOTA = 'quota'
+
+
+class BookingError(Exception):
+    pass
+
+
+class SlotTaken(BookingError):
+    pass
+
+
+class QuotaExceeded(BookingError):
+    pass
+
+
+def book(schedule, user, unit, date):
+    """ 予約を確定する。Log はこのトランザクションがコミットされたときに記録される """
+    try:
+        with transaction.atomic():
+            # 予約数の行をロックして同じユーザの予約処理を直列化し、
+            # 上限のチェックをすり抜けられないようにする。
+            # 予約数は Schedule の保存時にシグナルで同じトランザクションの中で増える
+            if quota.is_counted(date):
+                if quota.lock(user).count >= settings.ROOM_BOOKING_LIMIT:
+                    raise QuotaExceeded
+            schedule.unit = unit
+            schedule.date = date
+            schedule.subscriber = user
+            # (unit, date) の一意制約に引っかかった場合は入れ違いの予約があったということ
+            schedule.save()
+            audit.record(user, "CREATE", schedule)
+    except IntegrityError:
+        raise SlotTaken
+    return schedule
+
+
+def weekly_dates(start, end, weekday, interval=1):
+    """ start から end までの weekday 曜日を interval 週おきに並べる """
+    first = start + datetime.timedelta(days=(weekday - start.weekday()) % 7)
+    dates = []
+    date = first
+    while date <= end:
+        dates.append(date)
+        date += datetime.timedelta(weeks=interval)
+    return dates
+
+
+def book_many(template, user, unit, dates, check_quota=True, attempts=3):
+    """ 同じ時間割を複数の日付にまとめて予約する。
+
+    template の科目名・学部・人数で、空いている日付の Schedule と Log を
+    1つのトランザクションの中で bulk_create する。
+    返り値は {日付: BOOKED / TAKEN / OVER_QUOTA}。
+    """
+    for attempt in range(attempts):
+        try:
+            with transaction.atomic():
+                return _book_many(template, user, unit, dates, check_quota)
+        except IntegrityError:
+            # 空きを確かめてから書き込むまでの間に別の予約が入った。
+            # 全体を巻き戻したので、確かめるところからやり直す
+            if attempt == attempts - 1:
+                raise SlotTaken
+
+
+def _book_many(template, user, unit, dates, check_quota):
+    dates = sorted(set(dates))
+    taken = set(Schedule.objects.filter(
+        unit=unit, date__in=dates).values_list('date', flat=True))
+    results = {date: TAKEN for date in dates if date in taken}
+    free = [date for date in dates if date not in taken]
+
+    # 上限の対象になる日付は、残りの予約可能数の分だけ前から順に予約する
+    counted = [date for date in free if quota.is_counted(date)]
+    if check_quota and counted:
+        remaining = max(settings.ROOM_BOOKING_LIMIT - quota.lock(user).count, 0)
+        for date in counted[remaining:]:
+            results[date] = OVER_QUOTA
+
+    schedules = [
+        Schedule(unit=unit, date=date, subscriber=user,
+                 faculty=template.faculty, course=template.course,
+                 num_students=template.num_students)
+        for date in free if date not in results]
+    Schedule.objects.bulk_create(schedules)
+
+    # bulk_create ではシグナルが送られないので、予約数・キャッシュ・通知・Log をここで扱う
+    booked = [schedule.date for schedule in schedules]
+    num_counted = sum(1 for date in booked if quota.is_counted(date))
+    if num_counted:
+        quota.add(user.id, num_counted)
+    transaction.on_commit(lambda: cache.bump_versions(booked))
+    for date in booked:
+        events.publish(events.BOOKED, unit.id, date)
+    audit.record_many(user, "CREATE", schedules)
+    results.update((date, BOOKED) for date in booked)
+    return results
@@ -0,0 +1,68 @@
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+
+from . import routers
+
+# 予約状況のキャッシュ。
+# 日付ごとにバージョン番号を持ち、その日の Schedule が書き換わるたびに番号を上げる。
+# キャッシュのキーにはバージョン番号を含めるので、古いページが返ることはない。
+
+VERSION_KEY = 'room:version:%s'
+CATALOG = 'catalog'
+# 予約期間（room.windows）。変わると予約可否の表示が変わるので全ページを作り直す
+WINDOWS = 'windows'
+
+
+def _new_version():
+    # キーが追い出された後に作り直しても、過去の番号と衝突しないように時刻から作る
+    return int(time.time() * 1000000)
+
+
+def _version_name(date):
+    if isinstance(date, str):
+        return date
+    return date.isoformat()
+
+
+def get_versions(dates):
+    """ 日付（または 'catalog'）ごとのバージョン番号をまとめて取得する """
+    names = [_version_name(date) for date in dates]
+    keys = [VERSION_KEY % name for name in names]
+    found = cache.get_many(keys)
+    missing = [key for key in keys if key not in found]
+    if missing:
+        for key in missing:
+            cache.add(key, _new_version(), None)
+        found.update(cache.get_many(missing))
+    return [found[key] for key in keys]
+
+
+def bump_version(date):
+    key = VERSION_KEY % _version_name(date)
+    try:
+        cache.incr(key)
+    except ValueError:
+        cache.set(key, _new_version(), None)
+
+
+def bump_versions(dates):
+    for date in set(dates):
+        bump_version(date)
+
+
+def versioned_key(prefix, dates, *parts):
+    versions = get_versions([CATALOG, WINDOWS] + list(dates))
+    return ':'.join(['room', prefix] + [str(part) for part in parts] +
+                    [str(version) for version in versions])
+
+
+def get_or_build(key, build):
+    payload = cache.get(key)
+    if payload is None:
+        # 遅れているレプリカから作ると、古い内容が新しいバージョンで残ってしまう
+        with routers.primary():
+            payload = build()
+        cache.set(key, payload, settings.ROOM_CACHE_TIMEOUT)
+    return payload
@@ -0,0 +1,68 @@
+import threading
+from types import MappingProxyType
+
+from . import cache, routers
+from .models import Room, Unit
+
+
+class Catalog:
+    """ 教室と時間割の一覧。
+
+    学期中はほとんど変わらないので、プロセスごとに一度だけ読み込んで使い回す。
+    中身は読み取り専用として扱い、書き換えないこと。
+    units には予約を受け付けなくなった時間割（Unit.active が偽）も含むが、
+    曜日・時限ごとの一覧（slot_units など）には含めない。
+    """
+
+    def __init__(self, rooms, units):
+        self.rooms = MappingProxyType({room.id: room for room in rooms})
+        self.rooms_by_capacity = tuple(
+            sorted(rooms, key=lambda room: (room.capacity or 0, room.id)))
+        by_slot = {}
+        for unit in units:
+            # unit.room を参照しても DB に問い合わせないようにしておく
+            unit.room = self.rooms[unit.room_id]
+            if unit.active:
+                by_slot.setdefault((unit.weekday, unit.period), []).append(unit)
+        self.units = MappingProxyType({unit.id: unit for unit in units})
+        self.by_slot = MappingProxyType(
+            {slot: tuple(slot_units) for slot, slot_units in by_slot.items()})
+
+    def active_units(self):
+        return tuple(unit for units in self.by_slot.values() for unit in units)
+
+    def slot_units(self, weekday, period):
+        return self.by_slot.get((weekday, period), ())
+
+    def day_units(self, weekday):
+        return tuple(unit for period in range(1, 6)
+                     for unit in self.slot_units(weekday, period))
+
+    def slot_count(self, weekday, period):
+        return len(self.slot_units(weekday, period))
+
+
+_lock = threading.Lock()
+_current = None
+
+
+def get_catalog():
+    """ 現在の Catalog を返す。教室・時間割が変わっていれば読み込み直す """
+    global _current
+    version = cache.get_versions([cache.CATALOG])[0]
+    current = _current
+    if current is None or current[0] != version:
+        with _lock:
+            if _current is None or _current[0] != version:
+                # 遅れているレプリカから読むと、古い一覧が新しいバージョンのまま残ってしまう
+                with routers.primary():
+                    rooms = list(Room.objects.all())
+                    units = list(Unit.objects.all())
+                _current = (version, Catalog(rooms, units))
+            current = _current
+    return current[1]
+
+
+def invalidate():
+    global _current
+    _current = None
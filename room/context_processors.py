@@ -0,0 +1,14 @@
+from django.conf import settings
+
+from . import roles
+
+
+def role(request):
+    """ 全テンプレートで is_admin を使えるようにする """
+    return {'is_admin': roles.is_admin(request)}
+
+
+def events(request):
+    """ 予約状況の変化を受け取る URL（ASGI で動いていないときは None） """
+    return {'events_url': settings.ROOM_EVENTS_PATH
+            if settings.ROOM_EVENTS_ENABLED else None}
@@ -0,0 +1,131 @@
+import datetime
+import threading
+
+import numpy as np
+from django.conf import settings
+
+from . import cache, catalog
+from .models import Schedule
+
+
+class AvailabilityEngine:
+    """ 時間割 × 日付の予約状況を NumPy の真偽値行列で持ち、空き教室をまとめて探す。
+
+    occupied[i, j] は i 番目の時間割が start + j 日に予約済みかどうか。
+    各日付の列は、その日の予約状況のバージョンと一緒に覚えておき、
+    バージョンが変わった日の列だけを読み直す。
+    """
+
+    def __init__(self, unit_ids, weekdays, periods, capacities, start, days):
+        self.unit_ids = np.asarray(unit_ids, dtype=np.int64)
+        self.weekdays = np.asarray(weekdays, dtype=np.int8)
+        self.periods = np.asarray(periods, dtype=np.int8)
+        self.capacities = np.asarray(capacities, dtype=np.int32)
+        self.rows = {unit_id: i for i, unit_id in enumerate(unit_ids)}
+        self.start = start
+        self.days = days
+        self.occupied = np.zeros((len(self.unit_ids), days), dtype=bool)
+        self.versions = [None] * days
+        self.lock = threading.Lock()
+
+    @property
+    def end(self):
+        return self.start + datetime.timedelta(days=self.days - 1)
+
+    def covers(self, start, end):
+        return self.start <= start and end <= self.end
+
+    def column(self, date):
+        return (date - self.start).days
+
+    def load(self, dates, bookings):
+        """ dates の列を bookings（(unit_id, date) の組）で置き換える。lock を取ってから呼ぶ。
+
+        新しい列は別に作っておき、まとめて差し替える。
+        """
+        columns = {self.column(date): i for i, date in enumerate(dates)}
+        fresh = np.zeros((len(self.unit_ids), len(dates)), dtype=bool)
+        for unit_id, date in bookings:
+            row = self.rows.get(unit_id)
+            if row is not None:
+                fresh[row, columns[self.column(date)]] = True
+        self.occupied[:, list(columns)] = fresh
+
+    def search(self, dates, periods=None, min_capacity=0):
+        """ {(日付, 時限): [unit_id, ...]} の形で空いている時間割を返す """
+        columns = np.array([self.column(date) for date in dates], dtype=np.int64)
+        weekdays = np.array([date.weekday() for date in dates], dtype=np.int8)
+        candidates = self.capacities >= min_capacity
+        if periods:
+            candidates &= np.isin(self.periods, periods)
+        results = {}
+        # 時間割はその曜日の日付にしか関係しないので、曜日ごとに部分行列を取り出して調べる。
+        # 読み直し中の列を見ないよう、取り出すときは lock を取る
+        for weekday in np.unique(weekdays).tolist():
+            positions = np.nonzero(weekdays == weekday)[0]
+            rows = np.nonzero(candidates & (self.weekdays == weekday))[0]
+            with self.lock:
+                free = ~self.occupied[np.ix_(rows, columns[positions])]
+            found_rows, found_positions = np.nonzero(free)
+            for row, position in zip(rows[found_rows].tolist(),
+                                     positions[found_positions].tolist()):
+                key = (dates[position], int(self.periods[row]))
+                results.setdefault(key, []).append(int(self.unit_ids[row]))
+        return results
+
+
+def build_engine(current, start, days):
+    units = current.active_units()
+    return AvailabilityEngine(
+        [unit.id for unit in units],
+        [unit.weekday for unit in units],
+        [unit.period for unit in units],
+        [unit.room.capacity or 0 for unit in units],
+        start, days)
+
+
+def refresh(engine, dates):
+    """ 予約状況のバージョンが変わった日の列だけを DB から読み直す """
+    versions = cache.get_versions(dates)
+    with engine.lock:
+        stale = [(date, version) for date, version in zip(dates, versions)
+                 if engine.versions[engine.column(date)] != version]
+    if not stale:
+        return
+    # DB を読む間は lock を取らず、他のリクエストの検索を止めない
+    stale_dates = [date for date, _ in stale]
+    bookings = list(Schedule.objects.filter(date__in=stale_dates).values_list(
+        'unit_id', 'date'))
+    with engine.lock:
+        engine.load(stale_dates, bookings)
+        for date, version in stale:
+            engine.versions[engine.column(date)] = version
+
+
+_lock = threading.Lock()
+_current = None
+
+
+def get_engine(start, end):
+    """ start から end までを含む AvailabilityEngine を返す。
+
+    ふだんはプロセス全体で1つのエンジンを使い回す。範囲外の日付を聞かれたときは、
+    その範囲だけのエンジンをその場で作る。
+    """
+    global _current
+    current = catalog.get_catalog()
+    dates = [start + datetime.timedelta(days=day)
+             for day in range((end - start).days + 1)]
+    window_start = settings.ROOM_ENGINE_START or datetime.date.today()
+    with _lock:
+        engine = _current
+        # 時間割が変わったときと、日付が変わって保持する期間がずれたときに作り直す
+        if engine is None or engine.catalog is not current or \
+                engine.start != window_start:
+            engine = build_engine(current, window_start, settings.ROOM_ENGINE_DAYS)
+            engine.catalog = current
+            _current = engine
+    if not engine.covers(start, end):
+        engine = build_engine(current, start, len(dates))
+    refresh(engine, dates)
+    return engine
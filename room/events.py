@@ -0,0 +1,255 @@
+import asyncio
+import datetime
+import json
+import logging
+import threading
+from types import SimpleNamespace
+from urllib.parse import parse_qs
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib import auth
+from django.core.cache import cache
+from django.db import close_old_connections, transaction
+from django.http import parse_cookie
+from django.utils.module_loading import import_string
+
+from . import catalog
+
+logger = logging.getLogger(__name__)
+
+# 予約状況の変化を、開いているページにサーバ送信イベント（SSE）で知らせる。
+# Schedule が作られた・消された・書き換わったら、コミット後に
+# {'type', 'date', 'unit', 'period'} をブローカーに流し、stream() が購読中のページへ送る。
+# Django 3.1 の StreamingHttpResponse は非同期に流せないので、stream() は
+# asgi.py から直接呼ぶ ASGI アプリにしている（WSGI では使えない）。
+
+BOOKED = 'booked'
+FREED = 'freed'
+UPDATED = 'updated'
+
+SEQ_KEY = 'room:events:seq'
+EVENT_KEY = 'room:events:%d'
+# CacheBroker がキャッシュにイベントを残しておく秒数
+EVENT_TIMEOUT = 60
+# 1ページで購読できる日付の数
+MAX_DATES = 31
+
+
+class Subscription:
+    """ 1つの接続が受け取るイベントの列 """
+
+    def __init__(self, broker, dates, period=None):
+        self.broker = broker
+        self.dates = dates
+        self.period = period
+        self.loop = asyncio.get_running_loop()
+        # ページは何件届いても1回読み直すだけなので、溢れた分は捨てる
+        self.queue = asyncio.Queue(maxsize=100)
+
+    def matches(self, event):
+        if event['date'] not in self.dates:
+            return False
+        return self.period is None or event['period'] == self.period
+
+    def put(self, event):
+        """ どのスレッドからでも呼べる """
+        if self.matches(event):
+            self.loop.call_soon_threadsafe(self._put, event)
+
+    def _put(self, event):
+        if not self.queue.full():
+            self.queue.put_nowait(event)
+
+    async def get(self, timeout):
+        """ 次のイベント。timeout 秒届かなければ None """
+        try:
+            return await asyncio.wait_for(self.queue.get(), timeout)
+        except asyncio.TimeoutError:
+            return None
+
+    def close(self):
+        self.broker.unsubscribe(self)
+
+
+class LocalBroker:
+    """ 同じプロセスの購読者にだけ届ける。ASGI のワーカーが1つなら外部のサービスは要らない """
+
+    def __init__(self):
+        self.subscribers = set()
+        self.lock = threading.Lock()
+
+    def publish(self, event):
+        self.deliver(event)
+
+    def deliver(self, event):
+        with self.lock:
+            subscribers = list(self.subscribers)
+        for subscriber in subscribers:
+            try:
+                subscriber.put(event)
+            except RuntimeError:
+                # イベントループが閉じられた接続
+                self.unsubscribe(subscriber)
+
+    def subscribe(self, dates, period=None):
+        subscription = Subscription(self, dates, period)
+        with self.lock:
+            self.subscribers.add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self.lock:
+            self.subscribers.discard(subscription)
+
+
+class CacheBroker(LocalBroker):
+    """ 共有キャッシュ（CACHE_URL）を介して全プロセスに届ける。
+
+    イベントには通し番号を付けてキャッシュに置き、購読者のいるプロセスは
+    ROOM_EVENTS_POLL_INTERVAL 秒ごとに新しい番号のものを読んで配る。
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.poller = None
+
+    def publish(self, event):
+        cache.add(SEQ_KEY, 0, None)
+        seq = cache.incr(SEQ_KEY)
+        cache.set(EVENT_KEY % seq, event, EVENT_TIMEOUT)
+
+    def subscribe(self, dates, period=None):
+        subscription = super().subscribe(dates, period)
+        if self.poller is None or self.poller.done():
+            self.poller = asyncio.ensure_future(self.poll())
+        return subscription
+
+    async def poll(self):
+        read = sync_to_async(cache.get, thread_sensitive=False)
+        read_many = sync_to_async(cache.get_many, thread_sensitive=False)
+        last = await read(SEQ_KEY, 0)
+        while self.subscribers:
+            await asyncio.sleep(settings.ROOM_EVENTS_POLL_INTERVAL)
+            seq = await read(SEQ_KEY, 0)
+            if seq <= last:
+                continue
+            keys = [EVENT_KEY % n for n in range(max(last + 1, seq - 999), seq + 1)]
+            found = await read_many(keys)
+            for key in keys:
+                if key in found:
+                    self.deliver(found[key])
+            last = seq
+
+
+_broker = None
+
+
+def get_broker():
+    global _broker
+    if _broker is None:
+        _broker = import_string(settings.ROOM_EVENTS_BROKER)()
+    return _broker
+
+
+def publish(type, unit_id, date):
+    """ 予約の変化を知らせる。トランザクションの中ならコミット後に送る """
+    unit = catalog.get_catalog().units.get(unit_id)
+    event = {
+        'type': type,
+        'date': date.isoformat(),
+        'unit': unit_id,
+        'period': unit.period if unit else None,
+    }
+
+    def send():
+        try:
+            get_broker().publish(event)
+        except Exception:
+            # 通知に失敗しても予約そのものは成功させる
+            logger.exception('failed to publish %s', event)
+    transaction.on_commit(send)
+
+
+def load_user(headers):
+    """ リクエストのクッキーからログイン中のユーザを読む """
+    cookies = {}
+    for name, value in headers:
+        if name == b'cookie':
+            cookies.update(parse_cookie(value.decode('latin-1')))
+    try:
+        session = import_string(settings.SESSION_ENGINE + '.SessionStore')(
+            cookies.get(settings.SESSION_COOKIE_NAME))
+        return auth.get_user(SimpleNamespace(session=session))
+    finally:
+        close_old_connections()
+
+
+def parse_query(query_string):
+    query = parse_qs(query_string.decode('latin-1'))
+    dates = {datetime.date.fromisoformat(date).isoformat()
+             for date in query.get('date', [])}
+    period = int(query['period'][0]) if 'period' in query else None
+    if not dates or len(dates) > MAX_DATES:
+        raise ValueError('1 to %d dates are required' % MAX_DATES)
+    return dates, period
+
+
+async def respond(send, status, body):
+    await send({
+        'type': 'http.response.start',
+        'status': status,
+        'headers': [(b'content-type', b'text/plain; charset=utf-8')],
+    })
+    await send({'type': 'http.response.body', 'body': body})
+
+
+async def stream(scope, receive, send):
+    """ /events/?date=2021-06-22[&date=...][&period=1] を購読する ASGI アプリ """
+    try:
+        dates, period = parse_query(scope.get('query_string', b''))
+    except ValueError as e:
+        return await respond(send, 400, str(e).encode())
+    user = await sync_to_async(load_user, thread_sensitive=False)(
+        scope.get('headers', []))
+    if not user.is_authenticated:
+        return await respond(send, 403, b'login required')
+
+    subscription = get_broker().subscribe(dates, period)
+
+    async def disconnected():
+        while (await receive())['type'] != 'http.disconnect':
+            pass
+    watcher = asyncio.ensure_future(disconnected())
+    try:
+        await send({
+            'type': 'http.response.start',
+            'status': 200,
+            'headers': [
+                (b'content-type', b'text/event-stream'),
+                (b'cache-control', b'no-cache'),
+                # nginx にバッファさせず、すぐに送らせる
+                (b'x-accel-buffering', b'no'),
+            ],
+        })
+        await send({'type': 'http.response.body', 'body': b'retry: 5000\n\n',
+                    'more_body': True})
+        while not watcher.done():
+            getter = asyncio.ensure_future(
+                subscription.get(settings.ROOM_EVENTS_KEEPALIVE))
+            await asyncio.wait([getter, watcher],
+                               return_when=asyncio.FIRST_COMPLETED)
+            if watcher.done():
+                getter.cancel()
+                break
+            event = getter.result()
+            if event is None:
+                # 途中のプロキシに接続を切られないよう、ときどきコメントを送る
+                body = b': keepalive\n\n'
+            else:
+                body = ('event: slot\ndata: %s\n\n' % json.dumps(event)).encode()
+            await send({'type': 'http.response.body', 'body': body,
+                        'more_body': True})
+    finally:
+        subscription.close()
+        watcher.cancel()
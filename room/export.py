@@ -0,0 +1,212 @@
+import csv
+import re
+import zipfile
+from xml.sax.saxutils import escape
+
+from django.conf import settings
+from django.utils import timezone
+
+from .models import Log, Schedule
+
+# 予約と操作ログの書き出し（管理者ページと export_data コマンド）。
+# 教室・時間割・ユーザは同じクエリで結合し、iterator() で少しずつ読む
+# （PostgreSQL ではサーバサイドカーソルになる）。書き出しも少しずつ返すので、
+# 件数によらず使うメモリは一定になる。
+
+SCHEDULES = 'schedules'
+LOGS = 'logs'
+CSV = 'csv'
+XLSX = 'xlsx'
+
+WEEKDAYS = '月火水木金土日'
+
+# Excel が数式として読む先頭の文字。科目名など利用者が入力した値が
+# 数式として実行されないよう、これで始まる文字列には ' を前に付ける
+FORMULA_PREFIXES = ('=', '+', '-', '@', '\t', '\r')
+
+SCHEDULE_COLUMNS = (
+    ('ID', 'id'),
+    ('日付', 'date'),
+    ('曜日', 'unit__weekday'),
+    ('時限', 'unit__period'),
+    ('教室', 'unit__room__name'),
+    ('最大収容人数', 'unit__room__capacity'),
+    ('設置学部', 'faculty'),
+    ('科目名', 'course'),
+    ('最大利用者数', 'num_students'),
+    ('予約者', 'subscriber__email'),
+    ('姓', 'subscriber__last_name'),
+    ('名', 'subscriber__first_name'),
+)
+LOG_COLUMNS = (
+    ('ID', 'id'),
+    ('日時', 'created_at'),
+    ('種別', 'type'),
+    ('日付', 'date'),
+    ('曜日', 'unit__weekday'),
+    ('時限', 'unit__period'),
+    ('教室', 'unit__room__name'),
+    ('設置学部', 'faculty'),
+    ('科目名', 'course'),
+    ('最大利用者数', 'num_students'),
+    ('予約者', 'user__email'),
+    ('姓', 'user__last_name'),
+    ('名', 'user__first_name'),
+)
+
+
+def columns(kind):
+    return SCHEDULE_COLUMNS if kind == SCHEDULES else LOG_COLUMNS
+
+
+def rows(kind, start=None, end=None, faculty=None, room=None):
+    """ 予約（kind='schedules'）か操作ログ（kind='logs'）を1行ずつ返す。room は Room か、その id """
+    if kind == SCHEDULES:
+        queryset = Schedule.objects.order_by('date', 'unit__period', 'id')
+    else:
+        queryset = Log.objects.order_by('created_at', 'id')
+    if start:
+        queryset = queryset.filter(date__gte=start)
+    if end:
+        queryset = queryset.filter(date__lte=end)
+    if faculty:
+        queryset = queryset.filter(faculty=faculty)
+    if room:
+        queryset = queryset.filter(unit__room=room)
+    fields = [field for _, field in columns(kind)]
+    weekday = fields.index('unit__weekday')
+    created_at = fields.index('created_at') if kind == LOGS else None
+    for row in queryset.values_list(*fields).iterator(
+            chunk_size=settings.ROOM_EXPORT_CHUNK_SIZE):
+        row = list(row)
+        row[weekday] = WEEKDAYS[row[weekday]]
+        if created_at is not None:
+            row[created_at] = timezone.localtime(
+                row[created_at]).strftime('%Y-%m-%d %H:%M:%S')
+        yield row
+
+
+def filename(kind, format):
+    return '%s-%s.%s' % (kind, timezone.localdate().strftime('%Y%m%d'), format)
+
+
+def as_text(value):
+    """ 数式として読まれる文字列を、そのまま表示される文字列にする """
+    if isinstance(value, str) and value.startswith(FORMULA_PREFIXES):
+        return "'" + value
+    return value
+
+
+class Buffer:
+    """ 書かれたものを溜めておき、take() で取り出す。empty は str なら '' で bytes なら b'' """
+
+    def __init__(self, empty):
+        self.empty = empty
+        self.chunks = []
+
+    def write(self, data):
+        self.chunks.append(bytes(data) if isinstance(data, memoryview) else data)
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def take(self):
+        data = self.empty.join(self.chunks)
+        self.chunks = []
+        return data
+
+
+def write_csv(header, rows):
+    """ CSV を少しずつ返す。Excel で文字化けしないよう BOM を付ける """
+    buffer = Buffer('')
+    writer = csv.writer(buffer)
+    buffer.write('\ufeff')
+    writer.writerow(header)
+    for i, row in enumerate(rows, 1):
+        writer.writerow([as_text(value) for value in row])
+        if i % settings.ROOM_EXPORT_CHUNK_SIZE == 0:
+            yield buffer.take().encode('utf-8')
+    yield buffer.take().encode('utf-8')
+
+
+# XLSX は XML を zip にまとめたもの。外部のライブラリを使わずに、
+# シートを1行ずつ書いては zip の圧縮済みのデータを返していく
+XLSX_PARTS = {
+    '[Content_Types].xml': (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+        '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+        '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+        '<Default Extension="xml" ContentType="application/xml"/>'
+        '<Override PartName="/xl/workbook.xml" ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet.main+xml"/>'
+        '<Override PartName="/xl/worksheets/sheet1.xml" ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.worksheet+xml"/>'
+        '</Types>'),
+    '_rels/.rels': (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+        '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+        '<Relationship Id="rId1" Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/officeDocument" Target="xl/workbook.xml"/>'
+        '</Relationships>'),
+    'xl/workbook.xml': (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+        '<workbook xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main" '
+        'xmlns:r="http://schemas.openxmlformats.org/officeDocument/2006/relationships">'
+        '<sheets><sheet name="%s" sheetId="1" r:id="rId1"/></sheets></workbook>'),
+    'xl/_rels/workbook.xml.rels': (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+        '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+        '<Relationship Id="rId1" Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/worksheet" Target="worksheets/sheet1.xml"/>'
+        '</Relationships>'),
+}
+SHEET_HEAD = ('<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+              '<worksheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main">'
+              '<sheetData>')
+SHEET_TAIL = '</sheetData></worksheet>'
+# XML に書けない制御文字
+ILLEGAL = re.compile('[\x00-\x08\x0b\x0c\x0e-\x1f]')
+
+
+def xlsx_cell(value):
+    if value is None:
+        return '<c/>'
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return '<c><v>%s</v></c>' % value
+    text = escape(ILLEGAL.sub('', as_text(str(value))))
+    return '<c t="inlineStr"><is><t xml:space="preserve">%s</t></is></c>' % text
+
+
+def xlsx_row(row):
+    return '<row>%s</row>' % ''.join(xlsx_cell(value) for value in row)
+
+
+def write_xlsx(header, rows, sheet_name='Sheet1'):
+    """ XLSX を少しずつ返す """
+    buffer = Buffer(b'')
+    # 書き出し先はシークできないので、zip の各エントリの大きさは後ろに書かれる
+    with zipfile.ZipFile(buffer, 'w', zipfile.ZIP_DEFLATED) as archive:
+        for name, content in XLSX_PARTS.items():
+            if name == 'xl/workbook.xml':
+                content = content % escape(sheet_name)
+            archive.writestr(name, content)
+        with archive.open('xl/worksheets/sheet1.xml', 'w', force_zip64=True) as sheet:
+            sheet.write((SHEET_HEAD + xlsx_row(header)).encode('utf-8'))
+            for i, row in enumerate(rows, 1):
+                sheet.write(xlsx_row(row).encode('utf-8'))
+                if i % settings.ROOM_EXPORT_CHUNK_SIZE == 0:
+                    yield buffer.take()
+            sheet.write(SHEET_TAIL.encode('utf-8'))
+        yield buffer.take()
+    yield buffer.take()
+
+
+CONTENT_TYPES = {
+    CSV: 'text/csv; charset=utf-8',
+    XLSX: 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
+}
+
+
+def write(kind, format, rows):
+    """ rows() の結果を format（'csv' か 'xlsx'）で少しずつ返す """
+    header = [name for name, _ in columns(kind)]
+    if format == XLSX:
+        return write_xlsx(header, rows, sheet_name=kind)
+    return write_csv(header, rows)
@@ -0,0 +1,56 @@
+import datetime
+
+from django import forms
+from django.conf import settings
+
+from . import export
+from .models import Room, Schedule
+
+
+class RecurringBookingForm(forms.ModelForm):
+    start = forms.DateField(label='開始日', widget=forms.DateInput(attrs={'type': 'date'}))
+    end = forms.DateField(label='終了日', widget=forms.DateInput(attrs={'type': 'date'}))
+    interval = forms.TypedChoiceField(
+        label='繰り返し', coerce=int, initial=1,
+        choices=((1, '毎週'), (2, '隔週')))
+
+    class Meta:
+        model = Schedule
+        fields = ('course', 'faculty', 'num_students')
+
+    def clean(self):
+        cleaned_data = super().clean()
+        start = cleaned_data.get('start')
+        end = cleaned_data.get('end')
+        if start and end:
+            if end < start:
+                raise forms.ValidationError('終了日が開始日より前です')
+            if end - start > datetime.timedelta(days=settings.ROOM_TERM_MAX_DAYS):
+                raise forms.ValidationError(
+                    '期間は%d日以内で指定してください' % settings.ROOM_TERM_MAX_DAYS)
+        return cleaned_data
+
+
+class ExportForm(forms.Form):
+    kind = forms.ChoiceField(
+        label='種類', choices=((export.SCHEDULES, '予約'), (export.LOGS, '操作ログ')))
+    format = forms.ChoiceField(
+        label='形式', choices=((export.CSV, 'CSV'), (export.XLSX, 'Excel')))
+    start = forms.DateField(label='開始日', required=False,
+                            widget=forms.DateInput(attrs={'type': 'date'}))
+    end = forms.DateField(label='終了日', required=False,
+                          widget=forms.DateInput(attrs={'type': 'date'}))
+    faculty = forms.ChoiceField(
+        label='設置学部', required=False,
+        choices=[('', 'すべて')] + list(Schedule._meta.get_field('faculty').choices))
+    room = forms.ModelChoiceField(
+        label='教室', required=False, empty_label='すべて',
+        queryset=Room.objects.order_by('name'))
+
+    def clean(self):
+        cleaned_data = super().clean()
+        start = cleaned_data.get('start')
+        end = cleaned_data.get('end')
+        if start and end and end < start:
+            raise forms.ValidationError('終了日が開始日より前です')
+        return cleaned_data
@@ -0,0 +1,31 @@
+from asgiref.sync import sync_to_async
+from django.core.handlers import asgi
+
+_END = object()
+
+
+class ASGIHandler(asgi.ASGIHandler):
+    """ StreamingHttpResponse の中身を、イベントループではなくスレッドで作る ASGI ハンドラ。
+
+    Django 3.1 はストリーミングの中身をイベントループの上でそのまま回すので、
+    中で DB を読む TermCalendar や Export が SynchronousOnlyOperation になる。
+    """
+
+    async def send_response(self, response, send):
+        if not response.streaming:
+            return await super().send_response(response, send)
+        content = iter(response)
+        response.streaming_content = []
+        next_chunk = sync_to_async(next, thread_sensitive=True)
+
+        async def send_with_content(message):
+            # 見出しは Django に送らせ、最後の空の本体の前に中身を1つずつ送る
+            if message['type'] == 'http.response.body' and not message.get('more_body'):
+                while True:
+                    chunk = await next_chunk(content, _END)
+                    if chunk is _END:
+                        break
+                    await send({'type': 'http.response.body', 'body': chunk,
+                                'more_body': True})
+            await send(message)
+        await super().send_response(response, send_with_content)
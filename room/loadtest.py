@@ -0,0 +1,162 @@
+import math
+import threading
+import time
+import urllib.error
+import urllib.request
+
+from django.conf import settings
+from django.db import connection
+from django.test import Client
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+# ビューの負荷試験。
+# 各エンドポイントに同時に requests 回ずつリクエストを送り、応答時間の分布・
+# 1リクエストあたりのクエリ数・スループットを数える。
+
+
+def endpoints(date, unit, user):
+    """ {名前: (ログインするユーザの種類, パス)} """
+    return {
+        'Calendar': ('user', reverse(
+            'room:calendar', args=[date.year, date.month, date.day])),
+        'TermCalendar': ('user', reverse('room:term', args=[date.year, date.month])),
+        'ScheduleInDay': ('user', reverse(
+            'room:day', args=[date.year, date.month, date.day])),
+        'RoomsInUnit': ('admin', reverse(
+            'room:room', args=[date.year, date.month, date.day, unit.period])),
+        'Booking': ('user', reverse(
+            'room:booking', args=[unit.id, date.year, date.month, date.day])),
+        'MyPage': ('user', reverse('room:my_page')),
+        'Users': ('admin', reverse('room:users')),
+        'UserPage': ('admin', reverse('room:user_page', args=[user.id])),
+    }
+
+
+def host():
+    for name in settings.ALLOWED_HOSTS:
+        if name != '*':
+            return name.lstrip('.')
+    return 'testserver'
+
+
+class ClientDriver:
+    """ テストクライアントでプロセス内から呼ぶ。クエリ数も数える """
+
+    def __init__(self, user):
+        self.client = Client(HTTP_HOST=host())
+        self.client.force_login(user)
+
+    def get(self, path):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(path, secure=True)
+            if response.streaming:
+                b''.join(response.streaming_content)
+        return response.status_code, len(queries)
+
+
+class HttpDriver:
+    """ 起動中のサーバに HTTP で送る。クエリ数は数えられない """
+
+    def __init__(self, base_url, user):
+        # サーバと同じ DB にセッションを作り、そのクッキーで送る
+        client = Client()
+        client.force_login(user)
+        self.base_url = base_url.rstrip('/')
+        self.cookie = '%s=%s' % (
+            settings.SESSION_COOKIE_NAME,
+            client.cookies[settings.SESSION_COOKIE_NAME].value)
+
+    def get(self, path):
+        request = urllib.request.Request(
+            self.base_url + path, headers={'Cookie': self.cookie})
+        try:
+            with urllib.request.urlopen(request) as response:
+                response.read()
+                return response.status, None
+        except urllib.error.HTTPError as e:
+            return e.code, None
+
+
+def percentile(values, p):
+    """ 最近順位法のパーセンタイル """
+    if not values:
+        return None
+    values = sorted(values)
+    rank = max(math.ceil(len(values) * p / 100.0) - 1, 0)
+    return values[rank]
+
+
+def summarize(samples, elapsed):
+    timings = [ms for ms, _, _ in samples]
+    queries = [num for _, _, num in samples if num is not None]
+    return {
+        'requests': len(samples),
+        'errors': sum(1 for _, status, _ in samples if status >= 400),
+        'p50_ms': percentile(timings, 50),
+        'p95_ms': percentile(timings, 95),
+        'p99_ms': percentile(timings, 99),
+        'mean_ms': sum(timings) / len(timings) if timings else None,
+        'queries_per_request': sum(queries) / len(queries) if queries else None,
+        'throughput_rps': len(samples) / elapsed if elapsed else None,
+    }
+
+
+def run_endpoint(make_driver, path, requests, concurrency, warmup=0):
+    """ concurrency 個のスレッドで path に合計 requests 回リクエストを送る """
+    if warmup:
+        driver = make_driver()
+        for _ in range(warmup):
+            driver.get(path)
+        connection.close()
+
+    lock = threading.Lock()
+    remaining = [requests]
+    samples = []
+
+    def worker(driver):
+        try:
+            while True:
+                with lock:
+                    if remaining[0] <= 0:
+                        return
+                    remaining[0] -= 1
+                began = time.perf_counter()
+                status, num_queries = driver.get(path)
+                ms = (time.perf_counter() - began) * 1000
+                with lock:
+                    samples.append((ms, status, num_queries))
+        finally:
+            connection.close()
+
+    # ログインなどの準備は先に済ませておき、測るのはリクエストだけにする
+    threads = [threading.Thread(target=worker, args=(make_driver(),))
+               for _ in range(concurrency)]
+    began = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return summarize(samples, time.perf_counter() - began)
+
+
+def run(make_driver, targets, requests, concurrency, warmup=0, stdout=None):
+    """ targets は endpoints() の戻り値。make_driver(種類) はドライバを作る関数 """
+    results = {}
+    if stdout is not None:
+        stdout.write('%-16s %8s %6s %9s %9s %9s %8s %9s' % (
+            'endpoint', 'requests', 'errors', 'p50(ms)', 'p95(ms)', 'p99(ms)',
+            'queries', 'req/s'))
+    for name, (role, path) in targets.items():
+        result = run_endpoint(
+            lambda: make_driver(role), path, requests, concurrency, warmup)
+        result['path'] = path
+        results[name] = result
+        if stdout is not None:
+            stdout.write('%-16s %8d %6d %9.2f %9.2f %9.2f %8s %9.1f' % (
+                name, result['requests'], result['errors'], result['p50_ms'],
+                result['p95_ms'], result['p99_ms'],
+                '-' if result['queries_per_request'] is None
+                else '%.1f' % result['queries_per_request'],
+                result['throughput_rps']))
+    return results
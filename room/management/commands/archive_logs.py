@@ -0,0 +1,82 @@
+import datetime
+import gzip
+import json
+import os
+
+from django.core.management.base import BaseCommand, CommandError
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import transaction
+from django.utils import timezone
+
+from room.models import Log
+
+ARCHIVE_FIELDS = ('id', 'user_id', 'created_at', 'type', 'unit_id', 'date',
+                  'faculty', 'course', 'num_students')
+
+
+class Command(BaseCommand):
+    help = '古い Log を月ごとの gzip JSONL に書き出してから削除する'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'before', help='この日付より前に作られたログを退避する (YYYY-MM-DD)')
+        parser.add_argument('--dir', default='log_archive',
+                            help='書き出し先のディレクトリ')
+        parser.add_argument('--batch-size', type=int, default=1000)
+        parser.add_argument('--dry-run', action='store_true',
+                            help='書き出しも削除もせず、退避する件数を月ごとに表示する')
+
+    def handle(self, *args, **options):
+        try:
+            before = datetime.date.fromisoformat(options['before'])
+        except ValueError:
+            raise CommandError('invalid date: %s' % options['before'])
+        cutoff = timezone.make_aware(
+            datetime.datetime.combine(before, datetime.time()))
+        if not options['dry_run']:
+            os.makedirs(options['dir'], exist_ok=True)
+
+        # id の昇順に batch_size 件ずつ読み、書き出してから削除する。
+        # 途中で止まっても、次回は残っている行から続けられる
+        last_id = 0
+        total = 0
+        months = {}
+        while True:
+            rows = list(Log.objects.filter(created_at__lt=cutoff, id__gt=last_id)
+                        .order_by('id').values(*ARCHIVE_FIELDS)[:options['batch_size']])
+            if not rows:
+                break
+            partitions = self.partition(rows)
+            ids = [row['id'] for row in rows]
+            if options['dry_run']:
+                for month, month_rows in partitions.items():
+                    months[month] = months.get(month, 0) + len(month_rows)
+            else:
+                self.write_rows(options['dir'], partitions)
+                with transaction.atomic():
+                    Log.objects.filter(id__in=ids).delete()
+            last_id = ids[-1]
+            total += len(rows)
+            if not options['dry_run']:
+                self.stdout.write('archived %d logs' % total)
+        for month, num in sorted(months.items()):
+            self.stdout.write('logs-%s.jsonl.gz: %d logs' % (month, num))
+        self.stdout.write(self.style.SUCCESS('%s: %d logs' % (
+            'dry run' if options['dry_run'] else 'done', total)))
+
+    def partition(self, rows):
+        """ 作られた月ごとに分ける """
+        partitions = {}
+        for row in rows:
+            month = timezone.localtime(row['created_at']).strftime('%Y-%m')
+            partitions.setdefault(month, []).append(row)
+        return partitions
+
+    def write_rows(self, directory, partitions):
+        for month, month_rows in partitions.items():
+            path = os.path.join(directory, 'logs-%s.jsonl.gz' % month)
+            # 追記すると gzip のメンバーが増えるだけで、読み出しはそのままできる
+            with gzip.open(path, 'at', encoding='utf-8') as f:
+                for row in month_rows:
+                    f.write(json.dumps(row, cls=DjangoJSONEncoder,
+                                       ensure_ascii=False) + '\n')
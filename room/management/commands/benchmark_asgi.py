@@ -0,0 +1,167 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+import importlib
+import json
+import time
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.db.backends.signals import connection_created
+from django.test import AsyncClient, Client, override_settings
+from django.urls import clear_url_caches, reverse
+
+from room import loadtest, synthetic
+from room.management.commands.benchmark_views import git_commit
+from room.management.commands.generate_data import default_start
+from room.models import Schedule, Unit
+
+
+def use_async_views(enabled):
+    """ room.urls を読み直して、同期版と非同期版のビューを切り替える """
+    import room.urls
+    with override_settings(ROOM_ASYNC_VIEWS=enabled):
+        importlib.reload(room.urls)
+    clear_url_caches()
+
+
+class Command(BaseCommand):
+    help = ('Calendar・ScheduleInDay・RoomsInUnit について、WSGI の同期ワーカー1つと '
+            'ASGI のイベントループ1つで処理できるリクエスト数を比べる')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=200,
+                            help='エンドポイントごとのリクエスト数')
+        parser.add_argument('--concurrency', type=int, default=16,
+                            help='ASGI で同時に処理するリクエスト数')
+        parser.add_argument('--threads', type=int, default=32,
+                            help='非同期版が DB を使うスレッドプールの大きさ')
+        parser.add_argument('--latency', type=float, default=2.0,
+                            help='クエリごとに足す待ち時間（ミリ秒）。DB との往復を模す')
+        parser.add_argument('--uncached', action='store_true',
+                            help='予約状況のキャッシュを使わずに測る')
+        parser.add_argument('--rooms', type=int, default=100)
+        parser.add_argument('--users', type=int, default=1000)
+        parser.add_argument('--days', type=int, default=120)
+        parser.add_argument('--output', help='結果を JSON で書き出すファイル')
+
+    def handle(self, *args, **options):
+        # 本番のデータに触れないよう、テスト用 DB とプロセス内のキャッシュを使って計測する
+        old_name = connection.settings_dict['NAME']
+        connection.creation.create_test_db(
+            verbosity=0, autoclobber=True, serialize=False)
+        caches = override_settings(CACHES=synthetic.CACHES)
+        caches.enable()
+        latency = options['latency'] / 1000
+
+        def wait(execute, sql, params, many, context):
+            time.sleep(latency)
+            return execute(sql, params, many, context)
+
+        def add_latency(sender, connection, **kwargs):
+            connection.execute_wrappers.append(wait)
+
+        try:
+            synthetic.generate(
+                rooms=options['rooms'], users=options['users'],
+                start=default_start(), days=options['days'], logs=0,
+                stdout=self.stdout, open_booking=True)
+            admin = get_user_model().objects.create_user(
+                synthetic.PREFIX + 'admin', settings.ROOM_ADMIN_EMAILS[0])
+            date = Schedule.objects.order_by('date').values_list(
+                'date', flat=True).first()
+            unit = Unit.objects.filter(weekday=date.weekday()).first()
+            paths = {
+                'Calendar': reverse(
+                    'room:calendar', args=[date.year, date.month, date.day]),
+                'ScheduleInDay': reverse(
+                    'room:day', args=[date.year, date.month, date.day]),
+                'RoomsInUnit': reverse(
+                    'room:room', args=[date.year, date.month, date.day, unit.period]),
+            }
+            client = Client()
+            client.force_login(admin)
+
+            # ここから先に作られる接続（非同期版が使うスレッドの接続）にも待ち時間を足す
+            connection_created.connect(add_latency)
+            connection.execute_wrappers.append(wait)
+            # AsyncClient は Host を testserver に固定するので、計測中だけ許可する
+            # レプリカは本番の DB を指したままなので使わない
+            overrides = {'ALLOWED_HOSTS': settings.ALLOWED_HOSTS + ['testserver'],
+                         'ROOM_DB_REPLICA': None}
+            if options['uncached']:
+                overrides['ROOM_CACHE_TIMEOUT'] = 0
+            with override_settings(**overrides):
+                results = self.run(client, paths, options)
+        finally:
+            connection_created.disconnect(add_latency)
+            if wait in connection.execute_wrappers:
+                connection.execute_wrappers.remove(wait)
+            use_async_views(False)
+            caches.disable()
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                json.dump(results, f, ensure_ascii=False, indent=2)
+
+    def run(self, client, paths, options):
+        results = {
+            'commit': git_commit(),
+            'options': {name: options[name] for name in (
+                'requests', 'concurrency', 'threads', 'latency', 'uncached', 'rooms',
+                'users', 'days')},
+            'wsgi': {},
+            'asgi': {},
+        }
+        use_async_views(False)
+        for name, path in paths.items():
+            results['wsgi'][name] = self.run_wsgi(client, path, options['requests'])
+        use_async_views(True)
+        for name, path in paths.items():
+            results['asgi'][name] = asyncio.run(self.run_asgi(
+                client, path, options['requests'], options['concurrency'],
+                options['threads']))
+
+        self.stdout.write('%-16s %10s %10s %10s %10s' % (
+            'endpoint', 'wsgi req/s', 'asgi req/s', 'wsgi p95', 'asgi p95'))
+        for name in paths:
+            wsgi, asgi = results['wsgi'][name], results['asgi'][name]
+            self.stdout.write('%-16s %10.1f %10.1f %10.2f %10.2f' % (
+                name, wsgi['throughput_rps'], asgi['throughput_rps'],
+                wsgi['p95_ms'], asgi['p95_ms']))
+        return results
+
+    def run_wsgi(self, client, path, requests):
+        # 同期ワーカーは1つずつ順に処理する
+        client.get(path, secure=True)
+        samples = []
+        began = time.perf_counter()
+        for _ in range(requests):
+            started = time.perf_counter()
+            response = client.get(path, secure=True)
+            samples.append(((time.perf_counter() - started) * 1000,
+                            response.status_code, None))
+        return loadtest.summarize(samples, time.perf_counter() - began)
+
+    async def run_asgi(self, client, path, requests, concurrency, threads):
+        # イベントループ1つで、concurrency 件ずつ同時に処理させる
+        asyncio.get_running_loop().set_default_executor(
+            ThreadPoolExecutor(threads))
+        async_client = AsyncClient()
+        async_client.cookies = client.cookies
+        await async_client.get(path, secure=True)
+        samples = []
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def one():
+            async with semaphore:
+                started = time.perf_counter()
+                response = await async_client.get(path, secure=True)
+                samples.append(((time.perf_counter() - started) * 1000,
+                                response.status_code, None))
+
+        began = time.perf_counter()
+        await asyncio.gather(*[one() for _ in range(requests)])
+        return loadtest.summarize(samples, time.perf_counter() - began)
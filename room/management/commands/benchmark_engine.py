@@ -0,0 +1,94 @@
+import datetime
+import json
+import random
+import statistics
+import time
+
+from django.core.management.base import BaseCommand
+
+from room.engine import AvailabilityEngine
+
+CAPACITIES = [30, 48, 60, 80, 112, 150, 200, 300]
+
+
+def naive_search(units, booked, dates, periods, min_capacity):
+    """ RoomsInUnit と同じように、時間割を1つずつ調べる場合 """
+    results = {}
+    for date in dates:
+        for unit_id, weekday, period, capacity in units:
+            if weekday != date.weekday() or capacity < min_capacity:
+                continue
+            if periods and period not in periods:
+                continue
+            if (unit_id, date) in booked:
+                continue
+            results.setdefault((date, period), []).append(unit_id)
+    return results
+
+
+class Command(BaseCommand):
+    help = '空き教室検索エンジンの速さを、1件ずつ調べる場合と比べる（DB は使わない）'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--units', type=int, default=10000)
+        parser.add_argument('--days', type=int, default=200)
+        parser.add_argument('--fill', type=float, default=0.3)
+        parser.add_argument('--repeat', type=int, default=10)
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--output', help='結果を JSON で書き出すファイル')
+
+    def handle(self, *args, **options):
+        rng = random.Random(options['seed'])
+        start = datetime.date.today()
+        days = options['days']
+        units = [(i, rng.randrange(6), rng.randint(1, 5), rng.choice(CAPACITIES))
+                 for i in range(options['units'])]
+        booked = set()
+        for unit_id, weekday, _, _ in units:
+            for day in range(days):
+                date = start + datetime.timedelta(days=day)
+                if date.weekday() == weekday and rng.random() < options['fill']:
+                    booked.add((unit_id, date))
+
+        began = time.perf_counter()
+        engine = AvailabilityEngine(
+            [unit[0] for unit in units], [unit[1] for unit in units],
+            [unit[2] for unit in units], [unit[3] for unit in units],
+            start, days)
+        all_dates = [start + datetime.timedelta(days=day) for day in range(days)]
+        engine.load(all_dates, booked)
+        build_ms = (time.perf_counter() - began) * 1000
+        self.stdout.write('units=%d days=%d bookings=%d build=%.1fms' % (
+            len(units), days, len(booked), build_ms))
+
+        cases = {
+            '1 day, 1 period': (all_dates[:1], [1], 0),
+            '1 week, all periods': (all_dates[:7], [], 0),
+            '1 week, capacity>=100': (all_dates[:7], [], 100),
+            'term, periods 1-2, capacity>=100': (all_dates, [1, 2], 100),
+        }
+        results = {'build_ms': build_ms, 'cases': {}}
+        self.stdout.write('%-36s %12s %12s' % ('case', 'engine(ms)', 'naive(ms)'))
+        for name, (dates, periods, capacity) in cases.items():
+            engine_ms = self.measure(
+                lambda: engine.search(dates, periods, capacity), options['repeat'])
+            naive_ms = self.measure(
+                lambda: naive_search(units, booked, dates, periods, capacity),
+                options['repeat'])
+            expected = naive_search(units, booked, dates, periods, capacity)
+            actual = engine.search(dates, periods, capacity)
+            assert {key: sorted(value) for key, value in actual.items()} == expected
+            results['cases'][name] = {'engine_ms': engine_ms, 'naive_ms': naive_ms}
+            self.stdout.write('%-36s %12.3f %12.3f' % (name, engine_ms, naive_ms))
+
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                json.dump(results, f, ensure_ascii=False, indent=2)
+
+    def measure(self, function, repeat):
+        timings = []
+        for _ in range(repeat):
+            began = time.perf_counter()
+            function()
+            timings.append((time.perf_counter() - began) * 1000)
+        return statistics.median(timings)
@@ -0,0 +1,150 @@
+import datetime
+import json
+import statistics
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.db.models import Count
+from django.test import override_settings
+
+from room import synthetic
+from room.models import Log, Schedule, Unit
+
+MODELS = (Unit, Schedule, Log)
+
+
+def view_queries(start, unit, user):
+    """ 各ビューが発行する代表的なクエリ """
+    week = [start, start + datetime.timedelta(days=6)]
+    return {
+        'Calendar: slots': Unit.objects.order_by().values(
+            'weekday', 'period').annotate(num=Count('id')),
+        'Calendar: bookings': Schedule.objects.filter(
+            date__range=week).order_by().values(
+            'date', 'unit__period').annotate(num=Count('id')),
+        'ScheduleInDay: schedules': Schedule.objects.filter(
+            date=start).select_related('unit__room', 'subscriber'),
+        'ScheduleInDay: units': Unit.objects.filter(
+            weekday=start.weekday()).select_related('room'),
+        'RoomsInUnit: units': Unit.objects.filter(
+            weekday=unit.weekday, period=unit.period).select_related('room'),
+        'Booking: slot taken': Schedule.objects.filter(
+            unit=unit, date=start)[:1],
+        'Booking: quota': Schedule.objects.filter(
+            subscriber=user, date__gte=start).values('id'),
+        'MyPage: past schedules': Schedule.objects.filter(
+            subscriber=user, date__lt=start).order_by('-date', '-id')[:21],
+        'UserPage: logs': Log.objects.filter(
+            user=user).order_by('-created_at', '-id')[:21],
+    }
+
+
+class Command(BaseCommand):
+    help = ('テスト用 DB に大量のデータを作り、インデックスの有無で'
+            '各ビューのクエリの実行計画と時間を比べる')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rooms', type=int, default=1000)
+        parser.add_argument('--users', type=int, default=5000)
+        parser.add_argument('--days', type=int, default=200)
+        parser.add_argument('--logs', type=int, default=500000)
+        parser.add_argument('--repeat', type=int, default=20)
+        parser.add_argument('--output', help='結果を JSON で書き出すファイル')
+
+    def handle(self, *args, **options):
+        # 本番のデータに触れないよう、テスト用 DB とプロセス内のキャッシュを使って計測する
+        old_name = connection.settings_dict['NAME']
+        connection.creation.create_test_db(
+            verbosity=0, autoclobber=True, serialize=False)
+        try:
+            with override_settings(CACHES=synthetic.CACHES):
+                results = self.run(options)
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                json.dump(results, f, ensure_ascii=False, indent=2)
+
+    def run(self, options):
+        start = datetime.date.today()
+        synthetic.generate(
+            rooms=options['rooms'], users=options['users'], start=start,
+            days=options['days'], logs=options['logs'], stdout=self.stdout,
+            open_booking=True)
+
+        unit = Unit.objects.filter(weekday=start.weekday()).first() or Unit.objects.first()
+        user = Schedule.objects.values('subscriber').annotate(
+            num=Count('id')).order_by('-num').first()['subscriber']
+        queries = view_queries(start, unit, user)
+
+        results = {}
+        self.drop_indexes()
+        results['before'] = self.measure(queries, options['repeat'])
+        self.create_indexes()
+        results['after'] = self.measure(queries, options['repeat'])
+
+        self.stdout.write('%-28s %12s %12s' % ('query', 'before(ms)', 'after(ms)'))
+        for name in queries:
+            self.stdout.write('%-28s %12.3f %12.3f' % (
+                name, results['before'][name]['median_ms'],
+                results['after'][name]['median_ms']))
+        if options['verbosity'] >= 2:
+            for phase in ('before', 'after'):
+                for name, result in results[phase].items():
+                    self.stdout.write('[%s] %s\n%s\n' % (phase, name, result['plan']))
+        return results
+
+    def existing_names(self, model):
+        with connection.cursor() as cursor:
+            return set(connection.introspection.get_constraints(
+                cursor, model._meta.db_table))
+
+    # SQLite は制約の追加・削除でテーブルを作り直し、そのときにモデル定義どおりの
+    # インデックスと制約も作り直される（一意制約は外せない）。
+    # 制約を先に処理してから、実際にあるかどうかを見てインデックスを扱う
+    def drop_indexes(self):
+        with connection.schema_editor() as editor:
+            for model in MODELS:
+                for constraint in model._meta.constraints:
+                    editor.remove_constraint(model, constraint)
+        with connection.schema_editor() as editor:
+            for model in MODELS:
+                existing = self.existing_names(model)
+                for index in model._meta.indexes:
+                    if index.name in existing:
+                        editor.remove_index(model, index)
+        self.analyze()
+
+    def create_indexes(self):
+        with connection.schema_editor() as editor:
+            for model in MODELS:
+                for constraint in model._meta.constraints:
+                    editor.add_constraint(model, constraint)
+        with connection.schema_editor() as editor:
+            for model in MODELS:
+                existing = self.existing_names(model)
+                for index in model._meta.indexes:
+                    if index.name not in existing:
+                        editor.add_index(model, index)
+        self.analyze()
+
+    def analyze(self):
+        with connection.cursor() as cursor:
+            cursor.execute('ANALYZE')
+
+    def measure(self, queries, repeat):
+        results = {}
+        for name, queryset in queries.items():
+            timings = []
+            for _ in range(repeat):
+                began = time.perf_counter()
+                list(queryset.all())
+                timings.append((time.perf_counter() - began) * 1000)
+            results[name] = {
+                'median_ms': statistics.median(timings),
+                'max_ms': max(timings),
+                'plan': queryset.explain(),
+            }
+        return results
@@ -0,0 +1,121 @@
+import datetime
+import json
+import subprocess
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.db.models import Count
+from django.test import override_settings
+from django.utils import timezone
+
+from room import loadtest, roles, synthetic
+from room.management.commands.generate_data import default_start
+from room.models import Schedule, Unit
+from room.windows import is_available
+
+
+class Command(BaseCommand):
+    help = ('各ビューに同時にリクエストを送り、応答時間の p50/p95/p99・'
+            '1リクエストあたりのクエリ数・スループットを測る')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--url', help='起動中のサーバの URL（例: http://127.0.0.1:8000）。'
+                                          '省略時はテスト用 DB を作りテストクライアントで測る')
+        parser.add_argument('--requests', type=int, default=200,
+                            help='エンドポイントごとのリクエスト数')
+        parser.add_argument('--concurrency', type=int, default=8)
+        parser.add_argument('--warmup', type=int, default=5)
+        parser.add_argument('--endpoint', action='append', dest='endpoints',
+                            help='測るエンドポイントの名前（複数指定可。省略時はすべて）')
+        parser.add_argument('--rooms', type=int, default=100)
+        parser.add_argument('--users', type=int, default=1000)
+        parser.add_argument('--days', type=int, default=120)
+        parser.add_argument('--logs', type=int, default=100000)
+        parser.add_argument('--output', help='結果を JSON で書き出すファイル')
+
+    def handle(self, *args, **options):
+        if options['url']:
+            results = self.run(options)
+        else:
+            # 本番のデータに触れないよう、テスト用 DB とプロセス内のキャッシュを使って計測する。
+            # レプリカは本番のままなので使わない
+            old_name = connection.settings_dict['NAME']
+            connection.creation.create_test_db(
+                verbosity=0, autoclobber=True, serialize=False)
+            isolated = override_settings(
+                ROOM_DB_REPLICA=None, CACHES=synthetic.CACHES)
+            isolated.enable()
+            try:
+                synthetic.generate(
+                    rooms=options['rooms'], users=options['users'],
+                    start=default_start(), days=options['days'],
+                    logs=options['logs'], stdout=self.stdout,
+                    open_booking=True)
+                get_user_model().objects.create_user(
+                    synthetic.PREFIX + 'admin', settings.ROOM_ADMIN_EMAILS[0])
+                results = self.run(options)
+            finally:
+                isolated.disable()
+                connection.creation.destroy_test_db(old_name, verbosity=0)
+
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                json.dump(results, f, ensure_ascii=False, indent=2)
+
+    def run(self, options):
+        User = get_user_model()
+        admin = roles.admin_users().first()
+        user_id = Schedule.objects.values('subscriber').annotate(
+            num=Count('id')).order_by('-num').values_list(
+            'subscriber', flat=True).first()
+        if user_id is None:
+            raise CommandError('no schedules; run generate_data first')
+        user = User.objects.get(pk=user_id)
+        date = Schedule.objects.filter(subscriber=user).order_by(
+            '-date').values_list('date', flat=True).first()
+        unit = Unit.objects.filter(weekday=date.weekday()).order_by('id').first()
+
+        targets = loadtest.endpoints(date, unit, user)
+        today = datetime.date.today()
+        if date <= today or not is_available(date):
+            # 予約期間外の日付では予約ページが 404 になるので測らない
+            self.stderr.write('skipping Booking: %s is not bookable' % date)
+            del targets['Booking']
+        if admin is None:
+            self.stderr.write('skipping admin pages: no admin user')
+            targets = {name: target for name, target in targets.items()
+                       if target[0] != 'admin'}
+        if options['endpoints']:
+            targets = {name: target for name, target in targets.items()
+                       if name in options['endpoints']}
+
+        users = {'user': user, 'admin': admin}
+        if options['url']:
+            def make_driver(role):
+                return loadtest.HttpDriver(options['url'], users[role])
+        else:
+            def make_driver(role):
+                return loadtest.ClientDriver(users[role])
+
+        return {
+            'commit': git_commit(),
+            'started_at': timezone.now().isoformat(),
+            'target': options['url'] or 'client',
+            'options': {name: options[name] for name in (
+                'requests', 'concurrency', 'warmup', 'rooms', 'users', 'days', 'logs')},
+            'database': connection.vendor,
+            'endpoints': loadtest.run(
+                make_driver, targets, options['requests'],
+                options['concurrency'], options['warmup'], stdout=self.stdout),
+        }
+
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', 'HEAD'], cwd=settings.BASE_DIR, check=True,
+            capture_output=True, text=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
@@ -0,0 +1,79 @@
+import datetime
+import threading
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+
+from room import booking
+from room.models import Schedule, Unit
+
+STRESS_USER_PREFIX = 'booking-stress-'
+
+
+class Command(BaseCommand):
+    help = '同じ教室・日時への同時予約を発生させ、二重予約が起きないことを確認する'
+
+    def add_arguments(self, parser):
+        parser.add_argument('unit', type=int, help='予約する Unit の id')
+        parser.add_argument('date', help='予約する日付 (YYYY-MM-DD)')
+        parser.add_argument('--workers', type=int, default=200)
+        parser.add_argument('--rounds', type=int, default=1)
+
+    def handle(self, *args, **options):
+        try:
+            unit = Unit.objects.get(pk=options['unit'])
+        except Unit.DoesNotExist:
+            raise CommandError('Unit %s does not exist' % options['unit'])
+        date = datetime.date.fromisoformat(options['date'])
+        if Schedule.objects.filter(unit=unit, date=date).exists():
+            raise CommandError('%s is already booked on %s' % (unit, date))
+
+        User = get_user_model()
+        users = [
+            User.objects.create_user(
+                STRESS_USER_PREFIX + str(i),
+                STRESS_USER_PREFIX + str(i) + '@example.com')
+            for i in range(options['workers'])
+        ]
+        try:
+            for _ in range(options['rounds']):
+                self.run_round(users, unit, date)
+        finally:
+            # 作成したユーザを消すと、予約とログも一緒に消える
+            User.objects.filter(username__startswith=STRESS_USER_PREFIX).delete()
+
+    def run_round(self, users, unit, date):
+        results = {'booked': 0, 'taken': 0, 'error': 0}
+        lock = threading.Lock()
+        barrier = threading.Barrier(len(users))
+
+        def submit(user):
+            schedule = Schedule(
+                faculty='その他', course='stress', num_students=1)
+            barrier.wait()
+            try:
+                booking.book(schedule, user, unit, date)
+                outcome = 'booked'
+            except booking.BookingError:
+                outcome = 'taken'
+            except Exception:
+                outcome = 'error'
+            finally:
+                connection.close()
+            with lock:
+                results[outcome] += 1
+
+        threads = [threading.Thread(target=submit, args=(user,))
+                   for user in users]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        num_schedules = Schedule.objects.filter(unit=unit, date=date).count()
+        self.stdout.write('booked=%(booked)d taken=%(taken)d error=%(error)d'
+                          % results + ' schedules=%d' % num_schedules)
+        if num_schedules > 1 or results['booked'] > 1:
+            raise CommandError('double booking detected')
+        Schedule.objects.filter(unit=unit, date=date).delete()
@@ -0,0 +1,45 @@
+import datetime
+import sys
+
+from django.core.management.base import BaseCommand, CommandError
+
+from room import export
+from room.models import Room
+
+
+class Command(BaseCommand):
+    help = '予約（schedules）か操作ログ（logs）を CSV・XLSX で書き出す'
+
+    def add_arguments(self, parser):
+        parser.add_argument('kind', choices=(export.SCHEDULES, export.LOGS))
+        parser.add_argument('--format', choices=(export.CSV, export.XLSX),
+                            default=export.CSV)
+        parser.add_argument('--start', help='この日付以降の予約のもの (YYYY-MM-DD)')
+        parser.add_argument('--end', help='この日付以前の予約のもの (YYYY-MM-DD)')
+        parser.add_argument('--faculty', help='設置学部')
+        parser.add_argument('--room', help='教室名')
+        parser.add_argument('--output', help='書き出し先のファイル。省略時は標準出力')
+
+    def handle(self, *args, **options):
+        try:
+            start = options['start'] and datetime.date.fromisoformat(options['start'])
+            end = options['end'] and datetime.date.fromisoformat(options['end'])
+        except ValueError as e:
+            raise CommandError(e)
+        room = None
+        if options['room']:
+            room = Room.objects.filter(name=options['room']).first()
+            if room is None:
+                raise CommandError('unknown room: %s' % options['room'])
+
+        rows = export.rows(options['kind'], start=start, end=end,
+                           faculty=options['faculty'], room=room)
+        chunks = export.write(options['kind'], options['format'], rows)
+        if options['output']:
+            with open(options['output'], 'wb') as f:
+                for chunk in chunks:
+                    f.write(chunk)
+        else:
+            for chunk in chunks:
+                sys.stdout.buffer.write(chunk)
+            sys.stdout.buffer.flush()
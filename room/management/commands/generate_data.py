@@ -0,0 +1,55 @@
+import datetime
+
+from django.core.management import call_command
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from room import cache, catalog, synthetic
+
+
+class Command(BaseCommand):
+    help = ('負荷試験用に教室・時間割・ユーザ・1学期分の予約・数年分のログを作る。'
+            '作ったデータは名前が %s で始まる' % synthetic.PREFIX)
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rooms', type=int, default=100)
+        parser.add_argument('--users', type=int, default=1000)
+        parser.add_argument('--start', type=datetime.date.fromisoformat,
+                            help='予約を作り始める日 (YYYY-MM-DD)。省略時は今日')
+        parser.add_argument('--days', type=int, default=120)
+        parser.add_argument('--fill', type=float, default=0.3,
+                            help='予約で埋める時間割の割合')
+        parser.add_argument('--logs', type=int, default=100000)
+        parser.add_argument('--years', type=int, default=2,
+                            help='ログを散らばらせる年数')
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--batch-size', type=int, default=5000)
+        parser.add_argument('--clear', action='store_true',
+                            help='前に作ったデータを消してから作る')
+
+    def handle(self, *args, **options):
+        start = options['start'] or default_start()
+        if options['clear']:
+            synthetic.clear()
+            self.stdout.write('cleared previous data')
+        with transaction.atomic():
+            counts = synthetic.generate(
+                rooms=options['rooms'], users=options['users'], start=start,
+                days=options['days'], logs=options['logs'], fill=options['fill'],
+                seed=options['seed'], batch_size=options['batch_size'],
+                years=options['years'], stdout=self.stdout)
+
+        # bulk_create ではシグナルが送られないので、予約数とキャッシュをまとめて作り直す
+        call_command('rebuild_quotas', stdout=self.stdout)
+        cache.bump_version(cache.CATALOG)
+        catalog.invalidate()
+        cache.bump_versions(start + datetime.timedelta(days=day)
+                            for day in range(options['days']))
+        self.stdout.write(self.style.SUCCESS(
+            'generated %s from %s' % (
+                ', '.join('%d %s' % (num, name) for name, num in counts.items()),
+                start)))
+
+
+def default_start():
+    return datetime.date.today()
@@ -0,0 +1,174 @@
+import csv
+import datetime
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from room import cache, catalog
+from room.models import Log, Room, Schedule, Unit
+
+
+def read_csv(f):
+    """ room,capacity,weekday,period の CSV を1行ずつ読む。
+
+    weekday と period が空の行は、空き時間のない教室として扱う。
+    """
+    for row in csv.DictReader(f):
+        yield (row['room'], row['capacity'],
+               row.get('weekday') or None, row.get('period') or None)
+
+
+def read_jsonl(f):
+    """ {"room": ..., "capacity": ..., "slots": [[weekday, period], ...]} を1行ずつ読む """
+    for line in f:
+        if not line.strip():
+            continue
+        row = json.loads(line)
+        slots = row.get('slots') or [(None, None)]
+        for weekday, period in slots:
+            yield row['room'], row['capacity'], weekday, period
+
+
+READERS = {
+    'csv': read_csv,
+    'jsonl': read_jsonl,
+}
+
+
+class Command(BaseCommand):
+    help = ('教室と空き時間（曜日・時限）の時間割を読み込み、Room と Unit を'
+            'ファイルの内容に合わせる。何度実行しても結果は同じ')
+
+    def add_arguments(self, parser):
+        parser.add_argument('file', help='時間割の CSV または JSON Lines ファイル')
+        parser.add_argument('--format', choices=sorted(READERS),
+                            help='ファイル形式（省略時は拡張子から判断する）')
+        parser.add_argument('--batch-size', type=int, default=1000)
+        parser.add_argument('--dry-run', action='store_true',
+                            help='変更内容を表示するだけで書き込まない')
+
+    def handle(self, *args, **options):
+        path = options['file']
+        format = options['format'] or path.rsplit('.', 1)[-1].lower()
+        if format not in READERS:
+            raise CommandError('unknown format: %s' % format)
+
+        with open(path, encoding='utf-8-sig', newline='') as f:
+            timetable = self.read(READERS[format](f))
+
+        with transaction.atomic():
+            counts = self.apply(timetable, options['batch_size'])
+            if options['dry_run']:
+                transaction.set_rollback(True)
+            elif any(counts.values()):
+                # bulk_create などではシグナルが送られないので、ここでまとめて無効にする
+                transaction.on_commit(lambda: cache.bump_version(cache.CATALOG))
+                transaction.on_commit(catalog.invalidate)
+
+        self.stdout.write(self.style.SUCCESS(
+            '%s: %s' % ('dry run' if options['dry_run'] else 'done',
+                        ', '.join('%s %d' % item for item in counts.items()))))
+
+    def read(self, rows):
+        """ {教室名: (収容人数, {(曜日, 時限), ...})} にまとめる """
+        timetable = {}
+        for line, (name, capacity, weekday, period) in enumerate(rows, 1):
+            try:
+                capacity = int(capacity)
+                slot = None
+                if weekday is not None and period is not None:
+                    slot = (int(weekday), int(period))
+            except (TypeError, ValueError):
+                raise CommandError('invalid row %d: %r' % (
+                    line, (name, capacity, weekday, period)))
+            if slot is not None and not (0 <= slot[0] <= 6 and 1 <= slot[1] <= 5):
+                raise CommandError('invalid slot at row %d: %r' % (line, slot))
+            _, slots = timetable.setdefault(name, (capacity, set()))
+            if slot is not None:
+                slots.add(slot)
+        return timetable
+
+    def apply(self, timetable, batch_size):
+        counts = {
+            'rooms created': 0,
+            'rooms updated': 0,
+            'units created': 0,
+            'units restored': 0,
+            'units deleted': 0,
+            'units retired': 0,
+        }
+
+        rooms = {room.name: room for room in Room.objects.filter(
+            name__in=list(timetable)).only('id', 'name', 'capacity')}
+        new_rooms = [Room(name=name, capacity=capacity)
+                     for name, (capacity, _) in timetable.items()
+                     if name not in rooms]
+        Room.objects.bulk_create(new_rooms, batch_size=batch_size)
+        counts['rooms created'] = len(new_rooms)
+        changed = []
+        for name, room in rooms.items():
+            capacity = timetable[name][0]
+            if room.capacity != capacity:
+                room.capacity = capacity
+                changed.append(room)
+        Room.objects.bulk_update(changed, ['capacity'], batch_size=batch_size)
+        counts['rooms updated'] = len(changed)
+        if new_rooms:
+            # SQLite などでは bulk_create で id が入らないので読み直す
+            rooms = {room.name: room for room in Room.objects.filter(
+                name__in=list(timetable)).only('id', 'name')}
+
+        existing = {}
+        retired = set()
+        for unit_id, room_id, weekday, period, active in Unit.objects.filter(
+                room_id__in=[room.id for room in rooms.values()]).values_list(
+                'id', 'room_id', 'weekday', 'period', 'active').iterator():
+            existing[(room_id, weekday, period)] = unit_id
+            if not active:
+                retired.add(unit_id)
+
+        wanted = {(rooms[name].id, weekday, period)
+                  for name, (_, slots) in timetable.items()
+                  for weekday, period in slots}
+        new_units = [Unit(room_id=room_id, weekday=weekday, period=period)
+                     for room_id, weekday, period in sorted(wanted - set(existing))]
+        Unit.objects.bulk_create(new_units, batch_size=batch_size)
+        counts['units created'] = len(new_units)
+
+        # ファイルに戻ってきた時間割は、また予約を受け付ける
+        restored = [unit_id for key, unit_id in existing.items()
+                    if key in wanted and unit_id in retired]
+        for start in range(0, len(restored), batch_size):
+            Unit.objects.filter(id__in=restored[start:start + batch_size]).update(active=True)
+        counts['units restored'] = len(restored)
+
+        # ファイルからなくなった時間割は消す。予約やログが残っているものは
+        # 消すと一緒に消えてしまうので、残したまま予約を受け付けなくする
+        removed = [unit_id for key, unit_id in existing.items() if key not in wanted]
+        in_use = set()
+        for start in range(0, len(removed), batch_size):
+            batch = removed[start:start + batch_size]
+            in_use.update(Schedule.objects.filter(
+                unit_id__in=batch).values_list('unit_id', flat=True))
+            in_use.update(Log.objects.filter(
+                unit_id__in=batch).values_list('unit_id', flat=True))
+        deletable = [unit_id for unit_id in removed if unit_id not in in_use]
+        for start in range(0, len(deletable), batch_size):
+            Unit.objects.filter(id__in=deletable[start:start + batch_size]).delete()
+        counts['units deleted'] = len(deletable)
+        retiring = sorted(in_use - retired)
+        for start in range(0, len(retiring), batch_size):
+            Unit.objects.filter(id__in=retiring[start:start + batch_size]).update(active=False)
+        counts['units retired'] = len(retiring)
+
+        # これから先の予約が残っているものは、予約者に知らせられるよう一覧にする
+        today = datetime.date.today()
+        for start in range(0, len(retiring), batch_size):
+            for unit_id, date, email in Schedule.objects.filter(
+                    unit_id__in=retiring[start:start + batch_size],
+                    date__gt=today).order_by('unit_id', 'date').values_list(
+                    'unit_id', 'date', 'subscriber__email'):
+                self.stderr.write('unit %d is no longer in the timetable but is '
+                                  'booked on %s by %s' % (unit_id, date, email))
+        return counts
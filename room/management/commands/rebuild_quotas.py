@@ -0,0 +1,38 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Count
+
+from room import quota
+from room.models import BookingQuota
+
+
+class Command(BaseCommand):
+    help = 'ユーザごとの予約数を Schedule から数え直す'
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            # bulk_create で作った予約などで行のないユーザの行を先に作る。
+            # 予約中のユーザが同時に作っても衝突しないよう、既にある行は無視する
+            BookingQuota.objects.bulk_create(
+                [BookingQuota(user_id=user_id, count=0)
+                 for user_id in self.count().keys()],
+                batch_size=1000, ignore_conflicts=True)
+            # 数え直している間に予約が入らないよう、行をすべてロックしてから数える。
+            # 予約中のユーザが行を読めなくならないよう、行は消さずに数だけ書き換える
+            current = dict(BookingQuota.objects.select_for_update().order_by(
+                'user').values_list('user', 'count'))
+            counts = self.count()
+            changed = {}
+            for user_id, num in current.items():
+                if counts.get(user_id, 0) != num:
+                    changed.setdefault(counts.get(user_id, 0), []).append(user_id)
+            for num, user_ids in changed.items():
+                for i in range(0, len(user_ids), 1000):
+                    BookingQuota.objects.filter(
+                        user__in=user_ids[i:i + 1000]).update(count=num)
+        self.stdout.write(self.style.SUCCESS('rebuilt %d quotas (%d changed)' % (
+            len(current), sum(len(user_ids) for user_ids in changed.values()))))
+
+    def count(self):
+        return dict(quota.counted_schedules().order_by().values(
+            'subscriber').annotate(num=Count('id')).values_list('subscriber', 'num'))
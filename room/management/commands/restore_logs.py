@@ -0,0 +1,60 @@
+import gzip
+import json
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.utils.dateparse import parse_date, parse_datetime
+
+from room.models import Log, Unit
+
+
+class Command(BaseCommand):
+    help = 'archive_logs で書き出したログを Log テーブルに戻す'
+
+    def add_arguments(self, parser):
+        parser.add_argument('files', nargs='+',
+                            help='logs-YYYY-MM.jsonl.gz ファイル')
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        user_ids = set(get_user_model().objects.values_list('id', flat=True))
+        unit_ids = set(Unit.objects.values_list('id', flat=True))
+        restored = 0
+        skipped = 0
+        read = 0
+        for path in options['files']:
+            batch = []
+            count = 0
+            with gzip.open(path, 'rt', encoding='utf-8') as f:
+                for line in f:
+                    if not line.strip():
+                        continue
+                    row = json.loads(line)
+                    # ユーザや教室がすでに消えているログは戻せない
+                    if row['user_id'] not in user_ids or row['unit_id'] not in unit_ids:
+                        skipped += 1
+                        continue
+                    row['created_at'] = parse_datetime(row['created_at'])
+                    row['date'] = parse_date(row['date'])
+                    batch.append(Log(**row))
+                    read += 1
+                    if len(batch) >= options['batch_size']:
+                        count += self.save(batch)
+                        batch = []
+            count += self.save(batch)
+            restored += count
+            self.stdout.write('%s: restored %d logs' % (path, count))
+        self.stdout.write(self.style.SUCCESS(
+            'done: %d restored, %d already present, %d skipped' % (
+                restored, read - restored, skipped)))
+
+    def save(self, batch):
+        """ 戻した件数を返す。同じ id のログがすでにあれば（二重に戻した場合など）無視する """
+        if not batch:
+            return 0
+        ids = [log.id for log in batch]
+        with transaction.atomic():
+            before = Log.objects.filter(id__in=ids).count()
+            Log.objects.bulk_create(batch, ignore_conflicts=True)
+            return Log.objects.filter(id__in=ids).count() - before
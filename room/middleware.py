@@ -0,0 +1,284 @@
+import secrets
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connections
+from django.http import HttpResponse
+from django.template.loader import render_to_string
+from django.utils.deprecation import MiddlewareMixin
+from whitenoise.middleware import WhiteNoiseMiddleware
+
+from . import routers, timing
+
+TICKET_KEY = 'room:admission:ticket'
+HEAD_KEY = 'room:admission:head'
+IDLE_KEY = 'room:admission:idle'
+SLOT_KEY = 'room:admission:slot:%d'
+# 入場中の人数と空いている枠の一覧。待っている人が来るたびに全部の枠を読まないよう、
+# ROOM_ADMISSION_RETRY 秒に1回だけ枠を数え直し、その間は入退場のたびに増減させる
+ADMITTED_KEY = 'room:admission:admitted'
+FREE_KEY = 'room:admission:free'
+CURSOR_KEY = 'room:admission:cursor'
+SWEEP_KEY = 'room:admission:sweep'
+# 空いている枠を取りに行く回数の上限。取れなければ次の再読み込みで試す
+PROBES = 8
+COOKIE_NAME = 'room_admission'
+COOKIE_SALT = 'room.admission'
+PRIMARY_COOKIE_NAME = 'room_primary'
+SAFE_METHODS = ('GET', 'HEAD', 'OPTIONS')
+
+
+def release_admission(request):
+    """ 予約を終えた人の入場枠を、レスポンスを返すときに空けて次の人を入れる """
+    request.admission_release = True
+
+
+class AdmissionMiddleware(MiddlewareMixin):
+    """ 予約開始直後のアクセス集中に備えた待合室。
+
+    ROOM_ADMISSION_PATHS 以下へのアクセスは、同時に ROOM_ADMISSION_LIMIT 人までしか
+    通さない。それ以外の人には整理券を発行し、DB に触れない軽量な待機ページを返す。
+    入場状況は設定されたキャッシュで全ワーカーと共有する。待っている人の確認は
+    入場中の人数を読むだけで済ませ、全部の枠を数え直すのは一定時間に1回にする。
+    入場した人の枠は、予約を終えるか、操作のないまま一定時間が過ぎると空く。
+    予約状況を見ているだけなら ROOM_ADMISSION_IDLE_TIMEOUT 秒、予約のフォームを
+    開いていれば ROOM_ADMISSION_TIMEOUT 秒で空く。
+    """
+
+    def process_request(self, request):
+        if not settings.ROOM_ADMISSION_ENABLED:
+            return None
+        if not request.path.startswith(tuple(settings.ROOM_ADMISSION_PATHS)):
+            return None
+
+        timeout = settings.ROOM_ADMISSION_TIMEOUT \
+            if request.path.startswith(tuple(settings.ROOM_ADMISSION_FORM_PATHS)) \
+            else settings.ROOM_ADMISSION_IDLE_TIMEOUT
+        ticket, token, slot = self.read_cookie(request)
+        if slot is not None and cache.get(SLOT_KEY % slot) == token:
+            # 入場済みの人は、操作するたびに枠の期限を延ばす
+            cache.touch(SLOT_KEY % slot, timeout)
+            request.admission_slot = (slot, token)
+            return None
+
+        if ticket is None:
+            cache.add(TICKET_KEY, 0, None)
+            ticket = cache.incr(TICKET_KEY)
+            token = secrets.token_urlsafe(16)
+        slot = self.admit(ticket, token, timeout)
+        request.admission = '%d:%s:%s' % (
+            ticket, token, '' if slot is None else slot)
+        if slot is None:
+            return self.waiting_response(ticket)
+        request.admission_slot = (slot, token)
+        return None
+
+    def process_response(self, request, response):
+        if getattr(request, 'admission_release', False) and \
+                hasattr(request, 'admission_slot') and response.status_code < 400:
+            slot, token = request.admission_slot
+            if cache.get(SLOT_KEY % slot) == token and cache.delete(SLOT_KEY % slot):
+                self.count(-1)
+        if hasattr(request, 'admission'):
+            response.set_signed_cookie(
+                COOKIE_NAME, request.admission,
+                salt=COOKIE_SALT, httponly=True, samesite='Lax',
+                secure=settings.SESSION_COOKIE_SECURE)
+        return response
+
+    def read_cookie(self, request):
+        value = request.get_signed_cookie(
+            COOKIE_NAME, default=None, salt=COOKIE_SALT)
+        if not value:
+            return None, None, None
+        try:
+            ticket, token, slot = value.split(':')
+            return int(ticket), token, int(slot) if slot else None
+        except ValueError:
+            return None, None, None
+
+    def admit(self, ticket, token, timeout):
+        admitted, free = self.occupancy()
+        num_free = max(settings.ROOM_ADMISSION_LIMIT - admitted, 0)
+        head = cache.get(HEAD_KEY, 0)
+
+        # 空いている枠は、先に並んでいる整理券の人から順に使う
+        if ticket > head + num_free:
+            if num_free:
+                self.skip_abandoned(head, num_free)
+            return None
+        if not free:
+            return None
+        # 同時に入場する人が同じ枠を取り合わないよう、一覧の別の位置から試す
+        cache.add(CURSOR_KEY, 0, None)
+        start = cache.incr(CURSOR_KEY)
+        for n in range(min(len(free), PROBES)):
+            i = free[(start + n) % len(free)]
+            if cache.add(SLOT_KEY % i, token, timeout):
+                self.count(1)
+                if ticket > head:
+                    cache.set(HEAD_KEY, ticket, None)
+                cache.delete(IDLE_KEY)
+                return i
+        return None
+
+    def occupancy(self):
+        """ 入場中の人数と、最後に数え直したときに空いていた枠の一覧 """
+        if cache.add(SWEEP_KEY, True, settings.ROOM_ADMISSION_RETRY):
+            return self.sweep()
+        found = cache.get_many([ADMITTED_KEY, FREE_KEY])
+        if ADMITTED_KEY not in found or FREE_KEY not in found:
+            return self.sweep()
+        return found[ADMITTED_KEY], found[FREE_KEY]
+
+    def sweep(self):
+        # 期限切れで空いた枠は減らしようがないので、ここで数え直して合わせる
+        limit = settings.ROOM_ADMISSION_LIMIT
+        keys = [SLOT_KEY % i for i in range(limit)]
+        taken = cache.get_many(keys)
+        free = [i for i in range(limit) if keys[i] not in taken]
+        cache.set_many({ADMITTED_KEY: len(taken), FREE_KEY: free}, None)
+        return len(taken), free
+
+    def count(self, delta):
+        try:
+            cache.incr(ADMITTED_KEY, delta)
+        except ValueError:
+            # 追い出されていれば、次に数え直すときに作り直す
+            pass
+
+    def skip_abandoned(self, head, num_free):
+        # 待機ページを閉じた人の整理券が先頭に溜まると、空き枠があっても誰も入れなくなる。
+        # 空き枠が一定時間使われなければ、その分だけ先頭を進める
+        now = time.time()
+        since = cache.get_or_set(
+            IDLE_KEY, now, settings.ROOM_ADMISSION_RETRY * 4)
+        if now - since > settings.ROOM_ADMISSION_RETRY * 2:
+            cache.set(HEAD_KEY, head + num_free, None)
+            cache.delete(IDLE_KEY)
+
+    def waiting_response(self, ticket):
+        head = cache.get(HEAD_KEY, 0)
+        content = render_to_string('room/waiting.html', {
+            'position': max(ticket - head, 1),
+            'retry': settings.ROOM_ADMISSION_RETRY,
+        })
+        response = HttpResponse(content, status=503)
+        response['Retry-After'] = str(settings.ROOM_ADMISSION_RETRY)
+        response['Cache-Control'] = 'no-store'
+        return response
+
+
+class TimingMiddleware(MiddlewareMixin):
+    """ リクエストごとのクエリ数・SQL 時間・ビューとテンプレートの時間を測る。
+
+    ROOM_TIMING_ENABLED のときだけ動く。結果は Server-Timing ヘッダと
+    room.timing のログに出し、エンドポイントごとに集計する。
+    同じ SQL が ROOM_TIMING_DUPLICATE_THRESHOLD 回以上発行されたら N+1 として記録する。
+    少しずつ送るレスポンス（StreamingHttpResponse）は送り終えるまで測ってから記録する。
+    ヘッダは本文より先に送るので、その Server-Timing には送り始めるまでの時間だけが載る。
+    非同期版のビューがスレッドプールで発行するクエリは数えられない。
+    """
+
+    def process_request(self, request):
+        if settings.ROOM_TIMING_ENABLED:
+            request.timing = timing.RequestTiming()
+            # レプリカで読むクエリも数える
+            for connection in connections.all():
+                connection.execute_wrappers.append(request.timing)
+
+    def process_response(self, request, response):
+        if not hasattr(request, 'timing'):
+            return response
+        response['Server-Timing'] = timing.server_timing(request.timing.summary())
+        if response.streaming:
+            request.timing.phase = 'stream'
+            response.streaming_content = self.timed_stream(
+                request, response, response.streaming_content)
+        else:
+            self.finish(request, response)
+        return response
+
+    def timed_stream(self, request, response, content):
+        try:
+            yield from content
+        finally:
+            self.finish(request, response)
+
+    def finish(self, request, response):
+        for connection in connections.all():
+            if request.timing in connection.execute_wrappers:
+                connection.execute_wrappers.remove(request.timing)
+        match = request.resolver_match
+        timing.record(
+            match.view_name if match else 'unresolved', request.method,
+            request.path, response.status_code, request.timing.summary(),
+            request.timing.duplicates())
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        if hasattr(request, 'timing'):
+            request.timing.phase = 'view'
+            request.timing.view_started = time.perf_counter()
+
+    def process_template_response(self, request, response):
+        # TemplateResponse はビューが返った後に描画されるので、
+        # ここから描画後のコールバックまでをテンプレートの時間とする
+        if hasattr(request, 'timing'):
+            request.timing.phase = 'render'
+            request.timing.view_ended = time.perf_counter()
+            response.add_post_render_callback(
+                lambda response: self.rendered(request))
+        return response
+
+    def rendered(self, request):
+        request.timing.phase = 'middleware'
+        request.timing.render_ended = time.perf_counter()
+
+
+class ReplicaMiddleware(MiddlewareMixin):
+    """ ROOM_DB_REPLICA_VIEWS のビューへの GET を読み取り専用のレプリカで処理させる。
+
+    書き込みのリクエスト（POST など）の後 ROOM_DB_PIN_SECONDS 秒は、その人の読み取りを
+    プライマリに固定し、自分の予約がレプリカに届く前でも表示されるようにする。
+    固定はクッキーの有効期限で表すので、サーバ側には何も持たない。
+    """
+
+    def process_request(self, request):
+        routers.use_replica(False)
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        if routers.replica_alias() is None or request.method not in SAFE_METHODS:
+            return
+        if PRIMARY_COOKIE_NAME in request.COOKIES:
+            return
+        if request.resolver_match.view_name in settings.ROOM_DB_REPLICA_VIEWS:
+            request.replica = True
+            routers.use_replica(True)
+
+    def process_response(self, request, response):
+        routers.use_replica(False)
+        if getattr(request, 'replica', False) and response.streaming:
+            response.streaming_content = routers.stream_from_replica(
+                response.streaming_content)
+        if request.method not in SAFE_METHODS and response.status_code < 400 and \
+                routers.replica_alias() is not None:
+            response.set_cookie(
+                PRIMARY_COOKIE_NAME, '1', max_age=settings.ROOM_DB_PIN_SECONDS,
+                httponly=True, samesite='Lax', secure=settings.SESSION_COOKIE_SECURE)
+        return response
+
+
+class StaticFilesMiddleware(MiddlewareMixin):
+    """ WhiteNoiseMiddleware を非同期のリクエストでも使えるようにしたもの。
+
+    同期専用のミドルウェアが1つでもあると、ASGI ではその内側の処理が
+    1つのスレッドに集まり、リクエストが順番待ちになる。
+    """
+
+    def __init__(self, get_response=None):
+        super().__init__(get_response)
+        self.whitenoise = WhiteNoiseMiddleware(get_response)
+
+    def process_request(self, request):
+        return self.whitenoise.process_request(request)
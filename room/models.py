@@ -12,9 +12,6 @@ class Room(models.Model):
     capacity = models.PositiveIntegerField(
         '最大収容人数', blank=True, null=True, default=0)
 
-    class Meta:
-        ordering = ['capacity']
-
     def __str__(self):
         return self.name
 
@@ -34,9 +31,14 @@ class Unit(models.Model):
             (4, '4時限'), (5, '5時限')
         )
     )
+    # 時間割から外れても予約やログが残っているものは消さずに、予約を受け付けなくする
+    active = models.BooleanField('予約受付中', default=True)
 
     class Meta:
-        ordering = ['room']
+        indexes = [
+            models.Index(fields=['weekday', 'period'],
+                         name='unit_weekday_period_idx'),
+        ]
 
     def __str__(self):
         return str(self.room) + ", " + str(self.period) + " " + str(self.weekday)
@@ -68,7 +70,18 @@ class Schedule(models.Model):
     num_students = models.PositiveIntegerField('最大利用者数')
 
     class Meta:
-        ordering = ['date', 'unit']
+        indexes = [
+            # カレンダーや日別ページは日付で絞り込む
+            models.Index(fields=['date', 'unit'], name='schedule_date_unit_idx'),
+            # マイページや予約数の上限チェックはユーザと日付で絞り込む
+            models.Index(fields=['subscriber', 'date'],
+                         name='schedule_subscriber_date_idx'),
+        ]
+        constraints = [
+            # 同じ教室・時限を同じ日に二重に予約できないようにする
+            models.UniqueConstraint(
+                fields=['unit', 'date'], name='unique_schedule_unit_date'),
+        ]
 
     def __str__(self):
         date_string = self.date.strftime('%Y/%m/%d')
@@ -110,3 +123,54 @@ class Log(models.Model):
         '科目名', max_length=255,
     )
     num_students = models.PositiveIntegerField('最大利用者数')
+
+    class Meta:
+        indexes = [
+            # ユーザページのログ一覧は新しい順に取り出す
+            models.Index(fields=['user', 'created_at'],
+                         name='log_user_created_at_idx'),
+            # 古いログの退避で使う
+            models.Index(fields=['created_at'], name='log_created_at_idx'),
+        ]
+
+
+class Term(models.Model):
+    # 学期ごとの予約できる日付の範囲。受付の段階（BookingPhase）ごとに開く日付を決める
+    name = models.CharField('学期', max_length=255)
+    first_date = models.DateField('予約できる最初の日')
+    last_date = models.DateField('予約できる最後の日')
+
+    def __str__(self):
+        return self.name
+
+
+class BookingPhase(models.Model):
+    # 受付開始日から終了日までの間（空欄なら期限なし）、first_date から last_date までの
+    # 日付（空欄なら学期の範囲）を予約できるようにする。
+    # 学部や教室を指定すると、その学部・教室の予約だけに適用する
+    term = models.ForeignKey(Term, verbose_name='学期', related_name='phases',
+                             on_delete=CASCADE)
+    name = models.CharField('段階', max_length=255)
+    opens_on = models.DateField('受付開始日', blank=True, null=True)
+    closes_on = models.DateField('受付終了日', blank=True, null=True)
+    first_date = models.DateField('予約できる最初の日', blank=True, null=True)
+    last_date = models.DateField('予約できる最後の日', blank=True, null=True)
+    faculty = models.CharField(
+        '設置学部', choices=Schedule._meta.get_field('faculty').choices,
+        max_length=10, blank=True)
+    room = models.ForeignKey(Room, verbose_name='教室名', blank=True, null=True,
+                             on_delete=CASCADE)
+
+    def __str__(self):
+        return str(self.term) + " " + self.name
+
+
+class BookingQuota(models.Model):
+    # ユーザごとの予約数。Schedule の作成・削除と同じトランザクションで更新する
+    user = models.OneToOneField(
+        get_user_model(), verbose_name='予約者', primary_key=True,
+        on_delete=CASCADE)
+    count = models.IntegerField('予約数', default=0)
+
+    def __str__(self):
+        return str(self.user) + ": " + str(self.count)
@@ -0,0 +1,52 @@
+from urllib.parse import urlencode
+
+from django.db.models import Q
+from django.utils.dateparse import parse_date, parse_datetime
+
+# 履歴の1ページあたりの件数
+PAGE_SIZE = 20
+
+
+def encode_cursor(value, pk):
+    return value.isoformat() + '_' + str(pk)
+
+
+def decode_cursor(cursor):
+    try:
+        value, pk = cursor.rsplit('_', 1)
+        value = parse_datetime(value) or parse_date(value)
+        pk = int(pk)
+    except ValueError:
+        return None
+    if value is None:
+        return None
+    return value, pk
+
+
+def keyset_page(queryset, field, cursor, size=PAGE_SIZE):
+    """ field の新しい順（同じ値なら id の大きい順）に size 件を取り出す。
+
+    OFFSET を使わず、前のページの最後の行より後ろだけを条件で絞り込むので、
+    何ページ目でも同じコストで取得できる。次のページのカーソルも返す。
+    """
+    queryset = queryset.order_by('-' + field, '-id')
+    position = decode_cursor(cursor) if cursor else None
+    if position is not None:
+        value, pk = position
+        queryset = queryset.filter(
+            Q(**{field + '__lt': value}) | Q(**{field: value, 'id__lt': pk}))
+    rows = list(queryset[:size + 1])
+    next_cursor = None
+    if len(rows) > size:
+        rows = rows[:size]
+        next_cursor = encode_cursor(getattr(rows[-1], field), rows[-1].id)
+    return rows, next_cursor
+
+
+def page_url(request, name, cursor):
+    """ 他の一覧のカーソルは残したまま、name の一覧だけを次のページに進める URL """
+    if cursor is None:
+        return None
+    params = request.GET.copy()
+    params[name] = cursor
+    return '?' + urlencode(params)
@@ -0,0 +1,53 @@
+from django.conf import settings
+from django.db.models import F
+
+from .models import BookingQuota, Schedule
+
+
+def is_counted(date):
+    """ 予約数の上限の対象になる日付かどうか """
+    start = settings.ROOM_QUOTA_START
+    end = settings.ROOM_QUOTA_END
+    if start is not None and date < start:
+        return False
+    if end is not None and date > end:
+        return False
+    return True
+
+
+def count(user):
+    counts = BookingQuota.objects.filter(
+        user=user).values_list('count', flat=True)
+    return counts[0] if counts else 0
+
+
+def is_full(user):
+    return count(user) >= settings.ROOM_BOOKING_LIMIT
+
+
+def lock(user):
+    """ ユーザの予約数の行をロックして返す。トランザクションの中で呼ぶこと """
+    # 行がなければ先に作っておく（get_or_create は競合しても自分で解決する）
+    BookingQuota.objects.get_or_create(user=user)
+    return BookingQuota.objects.select_for_update().get(user=user)
+
+
+def adjust(user_id, date, delta):
+    if is_counted(date):
+        add(user_id, delta)
+
+
+def add(user_id, delta):
+    updated = BookingQuota.objects.filter(user_id=user_id).update(
+        count=F('count') + delta)
+    if not updated and delta > 0:
+        BookingQuota.objects.create(user_id=user_id, count=delta)
+
+
+def counted_schedules():
+    schedules = Schedule.objects.all()
+    if settings.ROOM_QUOTA_START is not None:
+        schedules = schedules.filter(date__gte=settings.ROOM_QUOTA_START)
+    if settings.ROOM_QUOTA_END is not None:
+        schedules = schedules.filter(date__lte=settings.ROOM_QUOTA_END)
+    return schedules
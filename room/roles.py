@@ -0,0 +1,63 @@
+import hashlib
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.db.models import Q
+
+from . import cache
+
+# 管理者かどうかの判定。
+# 設定のメールアドレス（ROOM_ADMIN_EMAILS）かグループ（ROOM_ADMIN_GROUP）で決まる。
+# 判定結果はセッションに保存し、同じセッションの2回目以降のリクエストでは DB を見ない。
+# グループの所属や設定が変わったら、保存済みの判定は使わずに判定し直す。
+
+SESSION_KEY = 'room_role'
+ROLES = 'roles'
+
+
+def resolve(user):
+    """ user が管理者かどうかを、設定とグループから判定する """
+    if not user.is_authenticated:
+        return False
+    if user.email in settings.ROOM_ADMIN_EMAILS:
+        return True
+    group = settings.ROOM_ADMIN_GROUP
+    return bool(group) and user.groups.filter(name=group).exists()
+
+
+def stamp():
+    """ 判定結果が有効かどうかを見分ける値。グループの変更か設定の変更で変わる """
+    config = repr((sorted(settings.ROOM_ADMIN_EMAILS), settings.ROOM_ADMIN_GROUP))
+    return '%s:%s' % (cache.get_versions([ROLES])[0],
+                      hashlib.md5(config.encode()).hexdigest()[:8])
+
+
+def is_admin(request):
+    """ ログイン中のユーザが管理者かどうか。セッションごとに一度だけ判定する """
+    if hasattr(request, '_room_is_admin'):
+        return request._room_is_admin
+    user = request.user
+    if not user.is_authenticated:
+        result = False
+    else:
+        current = [user.pk, stamp()]
+        stored = request.session.get(SESSION_KEY)
+        if stored is not None and stored[:2] == current:
+            result = stored[2]
+        else:
+            result = resolve(user)
+            request.session[SESSION_KEY] = current + [result]
+    request._room_is_admin = result
+    return result
+
+
+def admin_users():
+    """ 管理者にあたるユーザ """
+    condition = Q(email__in=settings.ROOM_ADMIN_EMAILS)
+    if settings.ROOM_ADMIN_GROUP:
+        condition |= Q(groups__name=settings.ROOM_ADMIN_GROUP)
+    return get_user_model().objects.filter(condition).distinct()
+
+
+def invalidate():
+    cache.bump_version(ROLES)
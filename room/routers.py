@@ -0,0 +1,76 @@
+import contextlib
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS
+
+# 読み取りの多いビュー（ROOM_DB_REPLICA_VIEWS）のクエリを読み取り専用のレプリカに送る。
+# どのリクエストをレプリカで読むかは ReplicaMiddleware が決め、このコンテキスト変数に置く。
+# 書き込みは常にプライマリに送る。
+
+_replica = ContextVar('room_replica', default=False)
+
+# レプリカの遅れでログインが切れたりしないよう、セッションは常にプライマリで読む
+# （ログイン中のユーザも room.backends がプライマリから読む）
+PRIMARY_APPS = {'sessions'}
+
+
+def replica_alias():
+    """ 設定されたレプリカの別名。DATABASES になければ None """
+    alias = settings.ROOM_DB_REPLICA
+    return alias if alias and alias in settings.DATABASES else None
+
+
+def is_replica_enabled():
+    return _replica.get() and replica_alias() is not None
+
+
+def use_replica(enabled):
+    _replica.set(enabled)
+
+
+@contextlib.contextmanager
+def primary():
+    """ この中の読み取りはプライマリで行う """
+    token = _replica.set(False)
+    try:
+        yield
+    finally:
+        _replica.reset(token)
+
+
+def stream_from_replica(content):
+    """ StreamingHttpResponse の中身を、1つずつレプリカで読みながら返す """
+    iterator = iter(content)
+    while True:
+        token = _replica.set(True)
+        try:
+            chunk = next(iterator)
+        except StopIteration:
+            return
+        finally:
+            _replica.reset(token)
+        yield chunk
+
+
+class ReplicaRouter:
+
+    def db_for_read(self, model, **hints):
+        if model._meta.app_label in PRIMARY_APPS:
+            return DEFAULT_DB_ALIAS
+        if _replica.get():
+            return replica_alias()
+        return None
+
+    def db_for_write(self, model, **hints):
+        # レプリカから読んだインスタンスを保存するときもプライマリに書く
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # レプリカはプライマリの複製なので、どちらから読んだものでも関連付けてよい
+        return True
+
+    def allow_migrate(self, db, app_label, **hints):
+        if db == replica_alias():
+            return False
+        return None
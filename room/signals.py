@@ -0,0 +1,75 @@
+from django.contrib.auth import get_user_model
+from django.contrib.auth.models import Group
+from django.db import transaction
+from django.db.models.signals import m2m_changed, post_delete, post_save
+from django.dispatch import receiver
+
+from . import backends, cache, catalog, events, quota, roles, windows
+from .models import BookingPhase, Room, Schedule, Term, Unit
+
+
+# Schedule が書き換わったら、その日付のキャッシュを無効にする。
+# コミット前に無効にすると、書き込み前の内容で作り直されてしまうのでコミット後に行う
+@receiver([post_save, post_delete], sender=Schedule)
+def bump_schedule_date(sender, instance, **kwargs):
+    date = instance.date
+    transaction.on_commit(lambda: cache.bump_version(date))
+
+
+# 予約数は Schedule の書き込みと同じトランザクションで増減させる
+@receiver(post_save, sender=Schedule)
+def count_created_schedule(sender, instance, created, **kwargs):
+    if created:
+        quota.adjust(instance.subscriber_id, instance.date, 1)
+
+
+@receiver(post_delete, sender=Schedule)
+def count_deleted_schedule(sender, instance, **kwargs):
+    quota.adjust(instance.subscriber_id, instance.date, -1)
+
+
+# 予約状況のページを開いている人に、コミット後に変化を知らせる
+@receiver(post_save, sender=Schedule)
+def publish_saved_schedule(sender, instance, created, **kwargs):
+    events.publish(events.BOOKED if created else events.UPDATED,
+                   instance.unit_id, instance.date)
+
+
+@receiver(post_delete, sender=Schedule)
+def publish_deleted_schedule(sender, instance, **kwargs):
+    events.publish(events.FREED, instance.unit_id, instance.date)
+
+
+# 教室や時間割が変わったら、コミット後に全ページのキャッシュを無効にする
+@receiver([post_save, post_delete], sender=Room)
+@receiver([post_save, post_delete], sender=Unit)
+def bump_catalog(sender, instance, **kwargs):
+    def bump():
+        cache.bump_version(cache.CATALOG)
+        catalog.invalidate()
+    transaction.on_commit(bump)
+
+
+# 予約期間が変わったら、読み込み直させて全ページのキャッシュを無効にする。
+# Schedule と同じく、書き込み前の期間で作り直されないようコミット後に行う
+@receiver([post_save, post_delete], sender=Term)
+@receiver([post_save, post_delete], sender=BookingPhase)
+def bump_windows(sender, instance, **kwargs):
+    def bump():
+        cache.bump_version(cache.WINDOWS)
+        windows.invalidate()
+    transaction.on_commit(bump)
+
+
+# キャッシュしているログイン中のユーザを、保存されたら読み直させる
+@receiver([post_save, post_delete], sender=get_user_model())
+def forget_user(sender, instance, **kwargs):
+    user_id = instance.pk
+    transaction.on_commit(lambda: backends.forget(user_id))
+
+
+# グループが変わったら、セッションに保存した管理者の判定をやり直させる
+@receiver(m2m_changed, sender=get_user_model().groups.through)
+@receiver([post_save, post_delete], sender=Group)
+def invalidate_roles(sender, **kwargs):
+    transaction.on_commit(roles.invalidate)
@@ -0,0 +1,129 @@
+import datetime
+import random
+
+from django.contrib.auth import get_user_model
+from django.utils import timezone
+
+from .models import BookingPhase, Log, Room, Schedule, Term, Unit
+
+# 負荷試験用のデータ。名前の先頭で本物のデータと区別する
+PREFIX = 'synthetic-'
+
+# 負荷試験中に使うキャッシュ。テスト用 DB から作ったページやユーザ、
+# 予約状況のバージョンを共有キャッシュ（CACHE_URL）に書かないよう、プロセス内に閉じる
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'room-synthetic',
+    },
+}
+
+FACULTIES = [choice for choice, _ in Schedule._meta.get_field('faculty').choices]
+CAPACITIES = [30, 48, 60, 80, 112, 150, 200, 300]
+
+
+def generate(rooms=100, users=1000, start=None, days=120, logs=100000,
+             fill=0.3, seed=0, batch_size=5000, stdout=None, years=2,
+             open_booking=False):
+    """ 教室・時間割・ユーザ・予約・ログをまとめて作る。
+
+    予約は start から days 日分、各時間割の fill の割合を埋める。
+    ログは start までの years 年間に散らばるように作る。
+    open_booking を指定すると、予約を作った期間を誰でも予約できる学期も作る。
+    本物の教室も予約できるようになるので、テスト用 DB でだけ指定すること。
+    """
+    rng = random.Random(seed)
+    start = start or datetime.date.today()
+    User = get_user_model()
+
+    def report(message):
+        if stdout is not None:
+            stdout.write(message)
+
+    Room.objects.bulk_create(
+        [Room(name=PREFIX + 'room-%d' % i, capacity=rng.choice(CAPACITIES))
+         for i in range(rooms)], batch_size=batch_size)
+    room_ids = list(Room.objects.filter(
+        name__startswith=PREFIX).values_list('id', flat=True))
+    report('rooms: %d' % len(room_ids))
+
+    # 土曜の3限までを含む、月〜土の各時限から6割程度を空き時間にする
+    slots = [(weekday, period) for weekday in range(6)
+             for period in range(1, 6) if weekday < 5 or period <= 3]
+    Unit.objects.bulk_create(
+        [Unit(room_id=room_id, weekday=weekday, period=period)
+         for room_id in room_ids for weekday, period in slots
+         if rng.random() < 0.6], batch_size=batch_size)
+    units_by_weekday = {}
+    for unit_id, weekday in Unit.objects.filter(room_id__in=room_ids).values_list(
+            'id', 'weekday'):
+        units_by_weekday.setdefault(weekday, []).append(unit_id)
+    report('units: %d' % sum(len(ids) for ids in units_by_weekday.values()))
+
+    User.objects.bulk_create(
+        [User(username=PREFIX + 'user-%d' % i,
+              email=PREFIX + 'user-%d@keio.jp' % i, password='!')
+         for i in range(users)], batch_size=batch_size)
+    user_ids = list(User.objects.filter(
+        username__startswith=PREFIX).values_list('id', flat=True))
+    report('users: %d' % len(user_ids))
+
+    batch = []
+    num_schedules = 0
+    for offset in range(days):
+        date = start + datetime.timedelta(days=offset)
+        for unit_id in units_by_weekday.get(date.weekday(), []):
+            if rng.random() >= fill:
+                continue
+            batch.append(Schedule(
+                unit_id=unit_id, date=date, faculty=rng.choice(FACULTIES),
+                course=PREFIX + 'course', subscriber_id=rng.choice(user_ids),
+                num_students=rng.randint(1, 30)))
+            if len(batch) >= batch_size:
+                Schedule.objects.bulk_create(batch)
+                num_schedules += len(batch)
+                batch = []
+    Schedule.objects.bulk_create(batch)
+    num_schedules += len(batch)
+    report('schedules: %d' % num_schedules)
+
+    all_unit_ids = [unit_id for ids in units_by_weekday.values()
+                    for unit_id in ids]
+    now = timezone.make_aware(datetime.datetime.combine(start, datetime.time()))
+    batch = []
+    for i in range(logs):
+        batch.append(Log(
+            user_id=rng.choice(user_ids),
+            created_at=now - datetime.timedelta(seconds=rng.randint(0, years * 365 * 86400)),
+            type=rng.choice(['CREATE', 'CREATE', 'UPDATE', 'DELETE']),
+            unit_id=rng.choice(all_unit_ids),
+            date=start - datetime.timedelta(days=rng.randint(0, years * 365)),
+            faculty=rng.choice(FACULTIES), course=PREFIX + 'course',
+            num_students=rng.randint(1, 30)))
+        if len(batch) >= batch_size:
+            Log.objects.bulk_create(batch)
+            batch = []
+    Log.objects.bulk_create(batch)
+    report('logs: %d' % logs)
+
+    if open_booking:
+        # 予約ページも測れるよう、予約を作った期間をいつでも予約できるようにしておく
+        term = Term.objects.create(
+            name=PREFIX + 'term', first_date=start,
+            last_date=start + datetime.timedelta(days=days - 1))
+        BookingPhase.objects.create(term=term, name=PREFIX + 'phase')
+
+    return {
+        'rooms': len(room_ids),
+        'users': len(user_ids),
+        'schedules': num_schedules,
+        'logs': logs,
+    }
+
+
+def clear():
+    """ generate() で作ったデータを消す。時間割・予約・ログは教室とユーザと、予約期間の段階は学期と一緒に消える """
+    User = get_user_model()
+    Term.objects.filter(name__startswith=PREFIX).delete()
+    Room.objects.filter(name__startswith=PREFIX).delete()
+    User.objects.filter(username__startswith=PREFIX).delete()
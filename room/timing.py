@@ -0,0 +1,135 @@
+import json
+import logging
+import time
+from collections import Counter
+
+from django.conf import settings
+from django.core.cache import cache
+
+logger = logging.getLogger(__name__)
+
+# エンドポイントごとの集計。全ワーカーで共有するためキャッシュに置き、
+# 件数と合計は incr で足し込む（時間はマイクロ秒の整数で持つ）
+ENDPOINTS_KEY = 'room:timing:endpoints'
+STAT_KEY = 'room:timing:%s:%s'
+COUNTERS = ('requests', 'total_us', 'view_us', 'render_us', 'sql_us',
+            'queries', 'n_plus_one')
+
+
+class RequestTiming:
+    """ 1リクエストの中で発行された SQL と、ビュー・テンプレートの時間を記録する """
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.view_started = None
+        self.view_ended = None
+        self.render_ended = None
+        self.phase = 'middleware'
+        self.queries = Counter()
+        self.sql = {}
+        self.num_queries = Counter()
+
+    def __call__(self, execute, sql, params, many, context):
+        # connection.execute_wrapper() に渡して、全クエリの時間を測る
+        began = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.sql[self.phase] = self.sql.get(self.phase, 0) + \
+                time.perf_counter() - began
+            self.num_queries[self.phase] += 1
+            self.queries[sql] += 1
+
+    def duplicates(self):
+        """ 同じ SQL が閾値以上繰り返されたもの（N+1 の疑い） """
+        threshold = settings.ROOM_TIMING_DUPLICATE_THRESHOLD
+        return [(sql, num) for sql, num in self.queries.most_common()
+                if num >= threshold]
+
+    def summary(self):
+        now = time.perf_counter()
+        view_started = self.view_started or now
+        view_ended = self.view_ended or now
+        return {
+            'total_ms': (now - self.started) * 1000,
+            'view_ms': (view_ended - view_started) * 1000,
+            'render_ms': ((self.render_ended or view_ended) - view_ended) * 1000,
+            'sql_ms': sum(self.sql.values()) * 1000,
+            'queries': sum(self.num_queries.values()),
+            'render_queries': self.num_queries['render'],
+        }
+
+
+def server_timing(summary):
+    return ', '.join([
+        'total;dur=%.1f' % summary['total_ms'],
+        'view;dur=%.1f' % summary['view_ms'],
+        'render;dur=%.1f' % summary['render_ms'],
+        'sql;dur=%.1f;desc="%d queries"' % (summary['sql_ms'], summary['queries']),
+    ])
+
+
+def record(endpoint, method, path, status, summary, duplicates):
+    """ 構造化ログに1行書き、エンドポイントの集計に足し込む """
+    entry = dict(summary, endpoint=endpoint, method=method, path=path,
+                 status=status,
+                 duplicates=[{'sql': sql, 'count': num} for sql, num in duplicates])
+    if summary['total_ms'] >= settings.ROOM_TIMING_SLOW_MS:
+        logger.warning(json.dumps(entry, ensure_ascii=False))
+    else:
+        logger.info(json.dumps(entry, ensure_ascii=False))
+
+    endpoints = cache.get(ENDPOINTS_KEY, ())
+    if endpoint not in endpoints:
+        cache.set(ENDPOINTS_KEY, sorted(set(endpoints) | {endpoint}), None)
+    values = {
+        'requests': 1,
+        'total_us': int(summary['total_ms'] * 1000),
+        'view_us': int(summary['view_ms'] * 1000),
+        'render_us': int(summary['render_ms'] * 1000),
+        'sql_us': int(summary['sql_ms'] * 1000),
+        'queries': summary['queries'],
+        'n_plus_one': 1 if duplicates else 0,
+    }
+    for name, value in values.items():
+        key = STAT_KEY % (endpoint, name)
+        cache.add(key, 0, None)
+        try:
+            cache.incr(key, value)
+        except ValueError:
+            cache.set(key, value, None)
+    # 最大値は厳密でなくてよいので、取り出して比べるだけにする
+    key = STAT_KEY % (endpoint, 'max_us')
+    if values['total_us'] > cache.get(key, 0):
+        cache.set(key, values['total_us'], None)
+
+
+def endpoint_stats():
+    """ エンドポイントごとの平均・最大を、平均時間の長い順に返す """
+    stats = []
+    for endpoint in cache.get(ENDPOINTS_KEY, ()):
+        names = COUNTERS + ('max_us',)
+        found = cache.get_many([STAT_KEY % (endpoint, name) for name in names])
+        values = {name: found.get(STAT_KEY % (endpoint, name), 0) for name in names}
+        requests = values['requests']
+        if not requests:
+            continue
+        stats.append({
+            'endpoint': endpoint,
+            'requests': requests,
+            'mean_ms': values['total_us'] / requests / 1000,
+            'max_ms': values['max_us'] / 1000,
+            'view_ms': values['view_us'] / requests / 1000,
+            'render_ms': values['render_us'] / requests / 1000,
+            'sql_ms': values['sql_us'] / requests / 1000,
+            'queries': values['queries'] / requests,
+            'n_plus_one': values['n_plus_one'],
+        })
+    return sorted(stats, key=lambda stat: stat['mean_ms'], reverse=True)
+
+
+def reset():
+    endpoints = cache.get(ENDPOINTS_KEY, ())
+    cache.delete_many([STAT_KEY % (endpoint, name) for endpoint in endpoints
+                       for name in COUNTERS + ('max_us',)])
+    cache.delete(ENDPOINTS_KEY)
@@ -1,8 +1,19 @@
+from django.conf import settings
 from django.urls import path
-from . import views
+from . import async_views, views
 
 app_name = 'room'
 
+# ASGI で動かすときは、予約状況を表示するだけのページを非同期版にする
+if settings.ROOM_ASYNC_VIEWS:
+    calendar = async_views.calendar
+    schedule_in_day = async_views.schedule_in_day
+    rooms_in_unit = async_views.rooms_in_unit
+else:
+    calendar = views.Calendar.as_view()
+    schedule_in_day = views.ScheduleInDay.as_view()
+    rooms_in_unit = views.RoomsInUnit.as_view()
+
 urlpatterns = [
     path('mypage/', views.MyPage.as_view(), name='my_page'),
     path('schedule/<int:pk>/',
@@ -11,13 +22,47 @@ urlpatterns = [
          views.MyPageScheduleDelete.as_view(), name='schedule_delete'),
     path('user/<int:pk>/', views.UserPage.as_view(), name='user_page'),
     path('user/', views.Users.as_view(), name='users'),
-    path('calendar/', views.Calendar.as_view(), name="calendar"),
+    path('timings/', views.Timings.as_view(), name='timings'),
+    path('export/', views.Export.as_view(), name='export'),
+    path('calendar/', calendar, name="calendar"),
     path('calendar/<int:month>/<int:day>/',
-         views.Calendar.as_view(), name='calendar'),
+         calendar, name='calendar'),
+    path('calendar/<int:year>/<int:month>/<int:day>/',
+         calendar, name='calendar'),
+    path('term/', views.TermCalendar.as_view(), name='term'),
+    path('term/<int:year>/<int:month>/',
+         views.TermCalendar.as_view(), name='term'),
     path('day/<int:month>/<int:day>/',
-         views.ScheduleInDay.as_view(), name='day'),
+         schedule_in_day, name='day'),
+    path('day/<int:year>/<int:month>/<int:day>/',
+         schedule_in_day, name='day'),
+    path('day/<int:year>/<int:month>/<int:day>/slot/',
+         views.DaySlot.as_view(), name='day_slot'),
     path('booking/<int:pk>/<int:month>/<int:day>/',
          views.Booking.as_view(), name='booking'),
+    path('booking/<int:pk>/<int:year>/<int:month>/<int:day>/',
+         views.Booking.as_view(), name='booking'),
+    path('booking/<int:pk>/recurring/',
+         views.RecurringBooking.as_view(), name='recurring_booking'),
     path('room/<int:month>/<int:day>/<int:period>',
-         views.RoomsInUnit.as_view(), name='room')
+         rooms_in_unit, name='room'),
+    path('room/<int:year>/<int:month>/<int:day>/<int:period>',
+         rooms_in_unit, name='room'),
+    path('room/<int:year>/<int:month>/<int:day>/<int:period>/slot/',
+         views.RoomSlot.as_view(), name='room_slot'),
+    path('api/calendar/', views.WeekAvailabilityAPI.as_view(),
+         name='api_calendar'),
+    path('api/calendar/<int:month>/<int:day>/',
+         views.WeekAvailabilityAPI.as_view(), name='api_calendar'),
+    path('api/calendar/<int:year>/<int:month>/<int:day>/',
+         views.WeekAvailabilityAPI.as_view(), name='api_calendar'),
+    path('api/day/<int:month>/<int:day>/',
+         views.DayAvailabilityAPI.as_view(), name='api_day'),
+    path('api/day/<int:year>/<int:month>/<int:day>/',
+         views.DayAvailabilityAPI.as_view(), name='api_day'),
+    path('api/room/<int:month>/<int:day>/<int:period>/',
+         views.SlotAvailabilityAPI.as_view(), name='api_room'),
+    path('api/room/<int:year>/<int:month>/<int:day>/<int:period>/',
+         views.SlotAvailabilityAPI.as_view(), name='api_room'),
+    path('api/search/', views.RoomSearchAPI.as_view(), name='api_search'),
 ]
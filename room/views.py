@@ -2,57 +2,198 @@ from django import shortcuts
 from django.contrib import messages
 from django.conf import settings
 from django.shortcuts import get_object_or_404, redirect
-from django.db.models import Q
+from django.db import transaction
+from django.db.models import Count, OuterRef, Q, Subquery
+from django.db.models.functions import Coalesce
 import datetime
+import hashlib
 from django.urls import reverse_lazy, reverse
 from django.contrib.auth.mixins import LoginRequiredMixin
-from django.http import Http404
+from django.http import Http404, HttpResponse, HttpResponseBadRequest, JsonResponse, StreamingHttpResponse
 from django.contrib.auth.models import User
 from django.urls import reverse
+from django.template import loader
+from django.utils.safestring import mark_safe
+from django.utils.cache import get_conditional_response
 from urllib.parse import urlencode
 
 # Create your views here.
 from django.views import generic
-from .models import Room, Unit, Schedule, Log
+from .models import Schedule, Log
+from . import audit, booking, cache, catalog, engine, export, pagination, quota, roles, timing, windows
+from .middleware import release_admission
+from .forms import ExportForm, RecurringBookingForm
+from .windows import is_available
 
-THIS_YEAR = 2021
 
-ADMIN = [
-    "admin1@keio.jp",
-    "admin2@keio.jp",
-]
+class Base(generic.TemplateView):
+    template_name = 'base.html'
 
 
-def is_available(booking_date):
-    PUBLIC_BOOKING_START = datetime.date(year=THIS_YEAR, month=6, day=3)
-    PUBLIC_BOOKING_END = datetime.date(year=THIS_YEAR, month=7, day=10)
-    LIMITED_BOOKING_PERIOD_START = datetime.date(
-        year=THIS_YEAR, month=6, day=21)
-    LIMITED_BOOKING_PERIOD_END = datetime.date(
-        year=THIS_YEAR, month=6, day=26)
+def get_unit_or_404(pk):
+    unit = catalog.get_catalog().units.get(pk)
+    if unit is None or not unit.active:
+        raise Http404
+    return unit
 
-    today = datetime.date.today()
-    if booking_date > PUBLIC_BOOKING_END:
-        return False
-    if booking_date < LIMITED_BOOKING_PERIOD_START:
-        return False
-    # if booking_date <= today:
-    #     return False
-    if today >= PUBLIC_BOOKING_START:
-        return True
-    return LIMITED_BOOKING_PERIOD_START <= booking_date <= LIMITED_BOOKING_PERIOD_END
 
+def get_date(year, month, day):
+    """ URL の年月日の日付。年を省いた URL は今の学期の年として扱う """
+    try:
+        return datetime.date(year=year or windows.current_year(),
+                             month=month, day=day)
+    except ValueError:
+        raise Http404
 
-class Base(generic.TemplateView):
-    template_name = 'base.html'
 
-    def get_context_data(self, **kwargs):
-        context = super().get_context_data(**kwargs)
-        if self.request.user.is_anonymous:
-            context['is_admin'] = False
+def iter_calendar(days, today, size=None):
+    """ 連続した日付 days を size 日ずつに区切り、(区切りの日付, カレンダー) を順に返す。
+
+    予約数は期間全体を1回のクエリで日付順に読み、区切りごとに数える。
+    長い期間でも、最初の区切りは全体を数え終わる前に返せる。
+    """
+    size = size or len(days)
+    units = catalog.get_catalog()
+    booking_windows = windows.get_windows()
+
+    # 最初と最後の日の間にある予約数を日付・時限ごとに集計する
+    booking_counts = Schedule.objects.filter(
+        date__gte=days[0], date__lte=days[-1]).values(
+        'date', 'unit__period').annotate(num=Count('id')).order_by(
+        'date').iterator()
+    row = next(booking_counts, None)
+
+    for i in range(0, len(days), size):
+        chunk = days[i:i + size]
+
+        # 1限から5限まで、予約可能数をカウントする辞書を作る。
+        # 各曜日の各時限の空いている教室の数は時間割の一覧から数える
+        calendar = {}
+        for period in range(1, 6):
+            calendar[period] = {
+                day: [units.slot_count(day.weekday(), period), 0,
+                      not booking_windows.is_open(day)]
+                for day in chunk
+            }
+
+        while row is not None and row['date'] <= chunk[-1]:
+            booking_period = row['unit__period']
+            booking_date = row['date']
+            if booking_period in calendar and booking_date in calendar[booking_period]:
+                calendar[booking_period][booking_date][0] -= row['num']
+                calendar[booking_period][booking_date][1] += row['num']
+            row = next(booking_counts, None)
+
+        for period in calendar:
+            for day in calendar[period]:
+                # 時間割から外れた教室の予約の分だけ、空きが負にならないようにする
+                calendar[period][day][0] = max(calendar[period][day][0], 0)
+                if day <= today:
+                    calendar[period][day][0] = 0
+                if calendar[period][day][2]:
+                    calendar[period][day][0] = 0
+        yield chunk, calendar
+
+
+def build_calendar(days, today):
+    for _, calendar in iter_calendar(days, today):
+        return calendar
+
+
+def build_day(date):
+    current = catalog.get_catalog()
+    schedules = Schedule.objects.filter(date=date).select_related('subscriber')
+    units = current.day_units(date.weekday())
+    rooms_dict = dict()
+    for room in current.rooms_by_capacity:
+        rooms_dict[room] = [None for _ in range(5)]
+    schedules_dict = dict()
+    for schedule in schedules:
+        schedule.unit = current.units[schedule.unit_id]
+        schedules_dict[schedule.unit] = schedule
+    for unit in units:
+        if unit in schedules_dict:
+            rooms_dict[unit.room][unit.period - 1] = schedules_dict[unit]
         else:
-            context['is_admin'] = self.request.user.email in ADMIN
-        return context
+            rooms_dict[unit.room][unit.period - 1] = unit
+    # 時間割から外れる前に入っていた予約も表示する
+    for unit, schedule in schedules_dict.items():
+        if not unit.active:
+            rooms_dict[unit.room][unit.period - 1] = schedule
+    return {
+        'rooms': rooms_dict,
+        'schedules': schedules_dict,
+        'schedules_set': set(schedules),
+    }
+
+
+def build_day_grid(date, is_admin, is_available):
+    """ 日別ページの表の中身を描画しておく。
+
+    管理者向けと、それ以外のユーザ向けの2種類。後者は自分の予約のセルを
+    あとから差し替えられるよう、予約済みのセルを目印のコメントで囲んでおく。
+    """
+    payload = build_day(date)
+    return {
+        'html': loader.render_to_string('room/day_grid.html', {
+            'rooms': payload['rooms'],
+            'schedules_set': payload['schedules_set'],
+            'is_admin': is_admin,
+            'is_available': is_available,
+            'date': date,
+        }),
+        'schedules': {
+            schedule.id: {'id': schedule.id,
+                          'subscriber_id': schedule.subscriber_id,
+                          'num_students': schedule.num_students}
+            for schedule in payload['schedules_set']},
+    }
+
+
+def get_day_grid(date, is_admin, is_available):
+    key = cache.versioned_key(
+        'day_grid', [date], date, 'admin' if is_admin else 'user', is_available)
+    return cache.get_or_build(
+        key, lambda: build_day_grid(date, is_admin, is_available))
+
+
+def overlay_day_grid(grid, user_id):
+    """ 共通の表のうち、user_id の予約のセルだけを自分用に描き直す """
+    html = grid['html']
+    for schedule in grid['schedules'].values():
+        if schedule['subscriber_id'] != user_id:
+            continue
+        start = '<!--schedule:%d-->' % schedule['id']
+        end = '<!--/schedule:%d-->' % schedule['id']
+        before, _, rest = html.partition(start)
+        _, _, after = rest.partition(end)
+        html = before + loader.render_to_string('room/day_booked.html', {
+            'schedule': schedule, 'mine': True}) + after
+    return mark_safe(html)
+
+
+def build_unit(date, period):
+    current = catalog.get_catalog()
+    # 教室を限った予約期間もあるので、教室ごとに確かめる
+    booking_windows = windows.get_windows()
+    unit_set = {unit for unit in current.slot_units(date.weekday(), period)
+                if booking_windows.is_open(date, room=unit.room_id)}
+    schedules = []
+    schedules_in_day = Schedule.objects.filter(
+        date=date, unit__in=[unit.id for unit in unit_set]).select_related(
+        'subscriber')
+    for schedule in schedules_in_day:
+        schedule.unit = current.units[schedule.unit_id]
+    schedules_in_day = sorted(schedules_in_day, key=lambda schedule: (
+        schedule.unit.room.capacity or 0, schedule.unit_id))
+    for schedule in schedules_in_day:
+        if schedule.unit in unit_set:
+            schedules.append(schedule)
+            unit_set.remove(schedule.unit)
+    return {
+        'units': list(unit_set),
+        'schedules': schedules,
+    }
 
 
 class Calendar(LoginRequiredMixin, generic.TemplateView):
@@ -67,7 +208,7 @@ class Calendar(LoginRequiredMixin, generic.TemplateView):
         month = self.kwargs.get('month')
         day = self.kwargs.get('day')
         if month and day:
-            base_date = datetime.date(year=THIS_YEAR, month=month, day=day)
+            base_date = get_date(self.kwargs.get('year'), month, day)
         else:
             base_date = today
 
@@ -76,42 +217,11 @@ class Calendar(LoginRequiredMixin, generic.TemplateView):
         start_day = days[0]
         end_day = days[-1]
 
-        # 1限から5限まで、1週間分の、予約可能数をカウントする辞書を作る
-        calendar = {}
-        for period in range(1, 6):
-            row = {}
-            for day in days:
-                row[day] = [0, 0, not is_available(day)]
-            calendar[period] = row
-
-        # 各曜日の各時限の空いている教室の数
-        num_slots = [[0] * 6 for _ in range(7)]
-
-        # 各曜日で予約可能スロットの数をカウント
-        unit_rooms = Unit.objects.filter()
-        for unit in unit_rooms:
-            num_slots[unit.weekday][unit.period] += 1
-
-        for period in range(1, 6):
-            for day in days:
-                calendar[period][day][0] = num_slots[day.weekday()][period]
-
-        # カレンダー表示する最初と最後の日の間にある予約を取得する
-        for schedule in Schedule.objects.filter(date__gte=start_day, date__lte=end_day):
-            booking_period = schedule.unit.period
-            booking_date = schedule.date
-            if booking_period in calendar and booking_date in calendar[booking_period]:
-                calendar[booking_period][booking_date][0] -= 1
-                calendar[booking_period][booking_date][1] += 1
-
-        for period in calendar:
-            for day in calendar[period]:
-                if day <= today:
-                    calendar[period][day][0] = 0
-                if (not is_available(day)):
-                    calendar[period][day][0] = 0
+        # 予約数は全ユーザ共通なので、週と各日のバージョンをキーにキャッシュする
+        key = cache.versioned_key('calendar', days, start_day, today)
+        calendar = cache.get_or_build(
+            key, lambda: build_calendar(days, today))
 
-        context['is_admin'] = self.request.user.email in ADMIN
         context['calendar'] = calendar
         context['days'] = days
         context['start_day'] = start_day
@@ -122,38 +232,92 @@ class Calendar(LoginRequiredMixin, generic.TemplateView):
         return context
 
 
+class TermCalendar(LoginRequiredMixin, generic.View):
+    """ 月や学期など、任意の期間のカレンダー。
+
+    /term/<年>/<月>/ でその月を、/term/?start=2021-04-05&end=2021-07-24 で
+    指定した期間を、月曜始まりの週に揃えて表示する。予約数は期間全体を
+    1回のクエリで読み、週ごとに描画したものを順に送る。
+    """
+    head_template_name = 'room/term.html'
+    week_template_name = 'room/term_week.html'
+    marker = '<!-- weeks -->'
+
+    def get(self, request, *args, **kwargs):
+        try:
+            start, end = self.get_range()
+        except ValueError:
+            return HttpResponseBadRequest('invalid date range')
+        # 週の途中から始まる期間でも列がそろうように、月曜から日曜までに広げる
+        start -= datetime.timedelta(days=start.weekday())
+        end += datetime.timedelta(days=6 - end.weekday())
+        num_days = (end - start).days + 1
+        if num_days > settings.ROOM_TERM_MAX_DAYS:
+            return HttpResponseBadRequest('date range is too long')
+        days = [start + datetime.timedelta(days=day) for day in range(num_days)]
+        # 見出しはメッセージやセッションを読むので、ミドルウェアの応答処理より前にここで描画する。
+        # 送りながら描画するのは週ごとのカレンダーだけ
+        today = datetime.date.today()
+        is_admin = roles.is_admin(request)
+        month = days[len(days) // 2].replace(day=1)
+        head, tail = loader.render_to_string(self.head_template_name, {
+            'is_admin': is_admin,
+            'start_day': days[0],
+            'end_day': days[-1],
+            'before': month - datetime.timedelta(days=1),
+            'next': month + datetime.timedelta(days=31),
+        }, request).split(self.marker)
+        return StreamingHttpResponse(
+            self.stream(head, tail, days, today, is_admin))
+
+    def get_range(self):
+        year = self.kwargs.get('year')
+        month = self.kwargs.get('month')
+        if year and month:
+            start = datetime.date(year=year, month=month, day=1)
+            end = (start + datetime.timedelta(days=31)).replace(day=1) - \
+                datetime.timedelta(days=1)
+        elif 'start' in self.request.GET and 'end' in self.request.GET:
+            start = datetime.date.fromisoformat(self.request.GET['start'])
+            end = datetime.date.fromisoformat(self.request.GET['end'])
+        else:
+            start = datetime.date.today().replace(day=1)
+            end = (start + datetime.timedelta(days=31)).replace(day=1) - \
+                datetime.timedelta(days=1)
+        if end < start:
+            raise ValueError('end is before start')
+        return start, end
+
+    def stream(self, head, tail, days, today, is_admin):
+        yield head
+        week = loader.get_template(self.week_template_name)
+        for chunk, calendar in iter_calendar(days, today, size=7):
+            yield week.render({
+                'is_admin': is_admin,
+                'days': chunk,
+                'calendar': calendar,
+                'today': today,
+            })
+        yield tail
+
+
 class ScheduleInDay(LoginRequiredMixin, generic.TemplateView):
     template_name = 'room/day.html'
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
-        month = self.kwargs.get('month')
-        day = self.kwargs.get('day')
-        date = datetime.date(year=THIS_YEAR, month=month, day=day)
-        schedules = Schedule.objects.filter(date=date)
-        units = Unit.objects.filter(weekday=date.weekday())
-        rooms = Room.objects.filter()
-        rooms_dict = dict()
+        date = get_date(self.kwargs.get('year'), self.kwargs.get('month'),
+                        self.kwargs.get('day'))
         today = datetime.date.today()
-        for room in rooms:
-            rooms_dict[room] = [None for _ in range(5)]
-        schedules_dict = dict()
-        for schedule in schedules:
-            schedules_dict[schedule.unit] = schedule
-        for unit in units:
-            if unit in schedules_dict:
-                rooms_dict[unit.room][unit.period - 1] = schedules_dict[unit]
-            else:
-                rooms_dict[unit.room][unit.period - 1] = unit
-        context['rooms'] = rooms_dict
-        context['schedules'] = schedules_dict
-        context['schedules_set'] = set(schedules)
+        is_admin = roles.is_admin(self.request)
+        is_open = is_available(date) and date > today
+        # 表は日付の予約状況のバージョンごとに描画して使い回し、自分の予約のセルだけ差し替える
+        grid = get_day_grid(date, is_admin, is_open)
+        context['grid'] = mark_safe(grid['html']) if is_admin else \
+            overlay_day_grid(grid, self.request.user.id)
         context['date'] = date
-        context['today'] = datetime.date.today()
-        context['is_admin'] = self.request.user.email in ADMIN
-        context['is_available'] = is_available(date)
-        if date <= today:
-            context['is_available'] = False
+        context['today'] = today
+        context['is_available'] = is_open
         return context
 
 
@@ -164,35 +328,85 @@ class RoomsInUnit(LoginRequiredMixin, generic.TemplateView):
         context = super().get_context_data(**kwargs)
         month = self.kwargs.get('month')
         day = self.kwargs.get('day')
-        date = datetime.date(year=THIS_YEAR, month=month, day=day)
-        weekday = date.weekday()
+        date = get_date(self.kwargs.get('year'), month, day)
         today = datetime.date.today()
         period = self.kwargs.get('period')
-        unit_set = set()
-        if (is_available(date)):
-            unit_set = set(Unit.objects.filter(weekday=weekday, period=period))
-        schedules = []
-        schedules_in_day = Schedule.objects.filter(date=date)
-        for schedule in schedules_in_day:
-            if schedule.unit in unit_set:
-                schedules.append(schedule)
-                unit_set.remove(schedule.unit)
-        is_admin = self.request.user.email in ADMIN
+        is_admin = roles.is_admin(self.request)
         if date <= today and not is_admin:
             raise Http404
         if not is_available(date) and not is_admin:
             raise Http404
-        context['is_admin'] = is_admin
+        key = cache.versioned_key('unit', [date], date, period, today)
+        context.update(cache.get_or_build(
+            key, lambda: build_unit(date, period)))
         context['month'] = month
         context['day'] = day
         context['date'] = date
         context['today'] = today
         context['period'] = period
-        context['units'] = list(unit_set)
-        context['schedules'] = schedules
         return context
 
 
+class SlotFragment(LoginRequiredMixin, generic.View):
+    """ 予約状況が変わった時間割（?unit=<id>）の部分だけの HTML。
+
+    日別ページと時限ページを開いている人に変化が届いたら、live.js がその部分だけを
+    読み直して差し替える。ページ全体を読み直すより軽い。
+    """
+    template_name = None
+
+    def get(self, request, *args, **kwargs):
+        date = get_date(kwargs['year'], kwargs['month'], kwargs['day'])
+        try:
+            unit = catalog.get_catalog().units[int(request.GET['unit'])]
+        except (KeyError, ValueError):
+            raise Http404
+        if unit.weekday != date.weekday():
+            raise Http404
+        schedule = Schedule.objects.filter(
+            unit=unit.id, date=date).select_related('subscriber').first()
+        if schedule is not None:
+            schedule.unit = unit
+        self.is_admin = roles.is_admin(request)
+        context = self.get_context(date, unit, schedule)
+        context['date'] = date
+        context['is_admin'] = self.is_admin
+        response = HttpResponse(loader.render_to_string(
+            self.template_name, context, request))
+        response['Cache-Control'] = 'private, no-cache'
+        return response
+
+
+class DaySlot(SlotFragment):
+    """ 日別ページの表の1つのセル """
+    template_name = 'room/day_cell.html'
+
+    def get_context(self, date, unit, schedule):
+        return {
+            'cell': schedule or unit,
+            'schedules_set': {schedule} if schedule else set(),
+            'is_available': is_available(date) and date > datetime.date.today(),
+            'mine': schedule is not None and
+            schedule.subscriber_id == self.request.user.id,
+        }
+
+
+class RoomSlot(SlotFragment):
+    """ 時限ページの予約可能・予約済の一覧の1行。どちらにも載らなければ空 """
+    template_name = 'room/unit_item.html'
+
+    def get_context(self, date, unit, schedule):
+        if unit.period != self.kwargs['period']:
+            raise Http404
+        booking_windows = windows.get_windows()
+        if not self.is_admin and (
+                date <= datetime.date.today() or not booking_windows.is_open(date)):
+            raise Http404
+        if not unit.active or not booking_windows.is_open(date, room=unit.room_id):
+            return {}
+        return {'unit': unit, 'schedule': schedule}
+
+
 class Booking(LoginRequiredMixin, generic.CreateView):
     model = Schedule
     fields = ('course', 'faculty', 'num_students')
@@ -200,39 +414,38 @@ class Booking(LoginRequiredMixin, generic.CreateView):
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
-        unit = get_object_or_404(Unit, pk=self.kwargs['pk'])
+        unit = get_unit_or_404(self.kwargs['pk'])
         context['unit'] = unit
         month = self.kwargs.get('month')
         day = self.kwargs.get('day')
         context['month'] = month
         context['day'] = day
-        date = datetime.date(year=THIS_YEAR, month=month, day=day)
+        date = get_date(self.kwargs.get('year'), month, day)
         context['date'] = date
         context['can_book'] = True
         context['message'] = ""
         today = datetime.date.today()
-        context['is_admin'] = self.request.user.email in ADMIN
         if date.weekday() != unit.weekday:
             raise Http404
         elif date <= today:
             raise Http404
-        elif not is_available(date):
+        elif not is_available(date, room=unit.room_id):
             raise Http404
         elif Schedule.objects.filter(unit=unit, date=date).exists():
             context['can_book'] = False
             context['message'] = "すでに予約されています"
             context['schedule'] = Schedule.objects.filter(
                 unit=unit, date=date)[0]
-        elif len(Schedule.objects.filter(subscriber=self.request.user)) >= 2:
+        elif quota.is_counted(date) and quota.is_full(self.request.user):
             context['can_book'] = False
             context['message'] = "予約数が上限に達しているため登録できません"
         return context
 
     def form_valid(self, form):
-        unit = get_object_or_404(Unit, pk=self.kwargs['pk'])
+        unit = get_unit_or_404(self.kwargs['pk'])
         month = self.kwargs.get('month')
         day = self.kwargs.get('day')
-        date = datetime.date(year=THIS_YEAR, month=month, day=day)
+        date = get_date(self.kwargs.get('year'), month, day)
         today = datetime.date.today()
         if date.weekday() != unit.weekday:
             messages.error(self.request, '不正な日時です。')
@@ -240,36 +453,85 @@ class Booking(LoginRequiredMixin, generic.CreateView):
             messages.error(self.request, '入れ違いで予約がありました')
         elif date <= today:
             messages.error(self.request, "予約可能期間を過ぎました")
-        elif len(Schedule.objects.filter(subscriber=self.request.user)) >= 2:
-            messages.error(self.request, "予約数が上限に達しているため登録できません")
+        elif not is_available(date, room=unit.room_id,
+                              faculty=form.cleaned_data.get('faculty')):
+            messages.error(self.request, "予約可能期間外です")
         elif form.cleaned_data.get("num_students") > unit.room.capacity:
             messages.error(self.request, "利用者数が収容人数を越えているため予約できません")
             url = reverse('room:booking', kwargs={
-                "pk": unit.id, "month": month, "day": day})
+                "pk": unit.id, "year": date.year, "month": month, "day": day})
             print(url)
             return redirect(url)
         else:
-            log = Log()
-            log.user = self.request.user
-            log.created_at = datetime.datetime.now()
-            log.type = "CREATE"
-            log.unit = unit
-            log.date = date
-            log.faculty = form.cleaned_data.get("faculty")
-            log.course = form.cleaned_data.get("course")
-            log.num_students = form.cleaned_data.get("num_students")
-            log.save()
-            schedule = form.save(commit=False)
-            schedule.unit = unit
-            schedule.date = date
-            schedule.subscriber = self.request.user
-            schedule.save()
-            message = date.strftime('%Y/%m/%d') + "の" + \
-                str(unit.period) + "限に" + str(unit.room) + "教室を予約しました"
-            messages.success(self.request, message)
+            try:
+                booking.book(form.save(commit=False),
+                             self.request.user, unit, date)
+            except booking.SlotTaken:
+                messages.error(self.request, '入れ違いで予約がありました')
+            except booking.QuotaExceeded:
+                messages.error(self.request, "予約数が上限に達しているため登録できません")
+            else:
+                message = date.strftime('%Y/%m/%d') + "の" + \
+                    str(unit.period) + "限に" + str(unit.room) + "教室を予約しました"
+                messages.success(self.request, message)
+                release_admission(self.request)
         return redirect('room:my_page')
 
 
+class RecurringBooking(LoginRequiredMixin, generic.FormView):
+    """ 同じ時間割を期間中の毎週（隔週）まとめて予約する。
+
+    管理者は予約期間と予約数の上限に関係なく予約できる。
+    予約後は日付ごとに予約できたかどうかを表示する。
+    """
+    form_class = RecurringBookingForm
+    template_name = 'room/recurring_booking.html'
+
+    def get_initial(self):
+        initial = super().get_initial()
+        initial['start'] = datetime.date.today() + datetime.timedelta(days=1)
+        return initial
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        context['unit'] = get_unit_or_404(self.kwargs['pk'])
+        return context
+
+    def form_valid(self, form):
+        unit = get_unit_or_404(self.kwargs['pk'])
+        is_admin = roles.is_admin(self.request)
+        if form.cleaned_data['num_students'] > (unit.room.capacity or 0):
+            form.add_error('num_students', "利用者数が収容人数を越えているため予約できません")
+            return self.form_invalid(form)
+
+        today = datetime.date.today()
+        dates = booking.weekly_dates(
+            form.cleaned_data['start'], form.cleaned_data['end'],
+            unit.weekday, form.cleaned_data['interval'])
+        booking_windows = windows.get_windows()
+        results = {}
+        for date in dates:
+            if date <= today or not (is_admin or booking_windows.is_open(
+                    date, room=unit.room_id, faculty=form.cleaned_data['faculty'])):
+                results[date] = booking.CLOSED
+        try:
+            results.update(booking.book_many(
+                form.save(commit=False), self.request.user, unit,
+                [date for date in dates if date not in results],
+                check_quota=not is_admin))
+        except booking.SlotTaken:
+            messages.error(self.request, '入れ違いで予約がありました。もう一度お試しください')
+            return self.form_invalid(form)
+
+        report = sorted(results.items())
+        num_booked = sum(1 for _, result in report if result == booking.BOOKED)
+        if num_booked:
+            release_admission(self.request)
+        messages.success(self.request, "%d件中%d件を予約しました" % (len(report), num_booked))
+        return self.render_to_response(self.get_context_data(
+            form=form, report=report))
+
+
 class MyPage(LoginRequiredMixin, generic.TemplateView):
     template_name = 'room/my_page.html'
 
@@ -277,12 +539,15 @@ class MyPage(LoginRequiredMixin, generic.TemplateView):
         context = super().get_context_data(**kwargs)
         today = datetime.date.today()
         context['schedule_list'] = Schedule.objects.filter(
-            subscriber=self.request.user, date__gte=today)
-        context['past_schedule_list'] = Schedule.objects.filter(
-            subscriber=self.request.user, date__lt=today)
-        context['log_list'] = Log.objects.filter(
-            user=self.request.user)
-        context['is_admin'] = self.request.user.email in ADMIN
+            subscriber=self.request.user, date__gte=today).select_related(
+            'unit__room').order_by('date', 'unit__period')
+        past_schedules, cursor = pagination.keyset_page(
+            Schedule.objects.filter(subscriber=self.request.user, date__lt=today)
+            .select_related('unit__room'),
+            'date', self.request.GET.get('past'))
+        context['past_schedule_list'] = past_schedules
+        context['past_next_url'] = pagination.page_url(
+            self.request, 'past', cursor)
         return context
 
 
@@ -304,20 +569,12 @@ class MyPageSchedule(LoginRequiredMixin, generic.UpdateView):
             messages.error(self.request, "他者の予約は編集できません")
         else:
             schedule = form.save(commit=False)
-            log = Log()
-            log.user = self.request.user
-            log.created_at = datetime.datetime.now()
-            log.type = "UPDATE"
-            log.unit = schedule.unit
-            log.date = schedule.date
-            log.faculty = schedule.faculty
-            log.course = schedule.course
-            log.num_students = schedule.num_students
-            log.save()
-            schedule.save()
-            message = log.date.strftime('%Y/%m/%d') + "の" + \
-                str(log.unit.period) + "限" + \
-                str(log.unit.room) + "教室の予約を更新しました"
+            with transaction.atomic():
+                schedule.save()
+                audit.record(self.request.user, "UPDATE", schedule)
+            message = schedule.date.strftime('%Y/%m/%d') + "の" + \
+                str(schedule.unit.period) + "限" + \
+                str(schedule.unit.room) + "教室の予約を更新しました"
             messages.success(self.request, message)
         return redirect(self.get_success_url())
 
@@ -333,8 +590,7 @@ class MyPageSchedule(LoginRequiredMixin, generic.UpdateView):
         context['day'] = date.day
         context['date'] = date
         context['email'] = self.request.user.email
-        is_admin = self.request.user.email in ADMIN
-        context['is_admin'] = is_admin
+        is_admin = roles.is_admin(self.request)
         context['can_edit'] = True
         today = datetime.date.today()
         if date <= today:
@@ -349,18 +605,9 @@ class MyPageScheduleDelete(LoginRequiredMixin, generic.DeleteView):
 
     def get_success_url(self):
         schedule = get_object_or_404(Schedule, pk=self.kwargs['pk'])
-        log = Log()
-        log.user = self.request.user
-        log.created_at = datetime.datetime.now()
-        log.type = "DELETE"
-        log.unit = schedule.unit
-        log.date = schedule.date
-        log.faculty = schedule.faculty
-        log.course = schedule.course
-        log.num_students = schedule.num_students
-        log.save()
-        message = log.date.strftime('%Y/%m/%d') + "の" + \
-            str(log.unit.period) + "限" + str(log.unit.room) + "教室の予約を削除しました"
+        audit.record(self.request.user, "DELETE", schedule)
+        message = schedule.date.strftime('%Y/%m/%d') + "の" + \
+            str(schedule.unit.period) + "限" + str(schedule.unit.room) + "教室の予約を削除しました"
         messages.success(self.request, message)
         return reverse('room:my_page')
 
@@ -381,7 +628,7 @@ class UserPage(LoginRequiredMixin, generic.TemplateView):
     template_name = 'room/user_page.html'
 
     def get_context_data(self, **kwargs):
-        if self.request.user.email not in ADMIN:
+        if not roles.is_admin(self.request):
             raise Http404
         user_id = self.kwargs['pk']
         try:
@@ -391,46 +638,253 @@ class UserPage(LoginRequiredMixin, generic.TemplateView):
         context = super().get_context_data(**kwargs)
         today = datetime.date.today()
         context['schedule_list'] = Schedule.objects.filter(
-            subscriber=user, date__gte=today)
-        context['past_schedule_list'] = Schedule.objects.filter(
-            subscriber=user, date__lt=today)
-        context['log_list'] = Log.objects.filter(
-            user=user)
+            subscriber=user, date__gte=today).select_related(
+            'unit__room').order_by('date', 'unit__period')
+        past_schedules, past_cursor = pagination.keyset_page(
+            Schedule.objects.filter(subscriber=user, date__lt=today)
+            .select_related('unit__room'),
+            'date', self.request.GET.get('past'))
+        logs, logs_cursor = pagination.keyset_page(
+            Log.objects.filter(user=user).select_related('unit__room'),
+            'created_at', self.request.GET.get('logs'))
+        context['past_schedule_list'] = past_schedules
+        context['past_next_url'] = pagination.page_url(
+            self.request, 'past', past_cursor)
+        context['log_list'] = logs
+        context['logs_next_url'] = pagination.page_url(
+            self.request, 'logs', logs_cursor)
         context['theuser'] = user
-        context['num_logs'] = len(context['log_list'])
-        context['is_admin'] = self.request.user.email in ADMIN
+        context['num_logs'] = Log.objects.filter(user=user).count()
         return context
 
 
-class Users(LoginRequiredMixin, generic.TemplateView):
+def count_by_user(queryset, field):
+    # ユーザごとの件数を相関サブクエリで数える（JOIN で行が増えないようにする）
+    counts = queryset.filter(**{field: OuterRef('pk')}).order_by().values(
+        field).annotate(num=Count('id')).values('num')
+    return Coalesce(Subquery(counts), 0)
+
+
+class Users(LoginRequiredMixin, generic.ListView):
     template_name = 'room/users.html'
+    context_object_name = 'users'
+    paginate_by = 50
 
-    def get_context_data(self, **kwargs):
-        if self.request.user.email not in ADMIN:
+    def get_queryset(self):
+        if not roles.is_admin(self.request):
             raise Http404
-        users = User.objects.filter()
+        today = datetime.date.today()
+        return User.objects.annotate(
+            num_schedules=count_by_user(
+                Schedule.objects.filter(date__gte=today), 'subscriber'),
+            num_past_schedules=count_by_user(
+                Schedule.objects.filter(date__lt=today), 'subscriber'),
+            num_logs=count_by_user(Log.objects.all(), 'user'),
+        ).order_by('-num_logs', 'id')
+
+    def get_paginator(self, queryset, per_page, **kwargs):
+        paginator = super().get_paginator(queryset, per_page, **kwargs)
+        # 総件数はサブクエリ抜きで数える
+        paginator.count = User.objects.count()
+        return paginator
+
+    def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
-        users_dict = dict()
-        for user in users:
-            users_dict[user] = [user, 0, 0, 0]  # [user, 直近の予約件数, 過去の予約件数, ログ数]
         today = datetime.date.today()
-        schedules = Schedule.objects.filter(
-            date__gte=today)
-        for schedule in schedules:
-            users_dict[schedule.subscriber][1] += 1
-        past_schedules = Schedule.objects.filter(
-            date__lt=today)
-        for past_schedule in past_schedules:
-            users_dict[past_schedule.subscriber][2] += 1
-        logs = Log.objects.filter()
-        for log in logs:
-            users_dict[log.user][3] += 1
-        users = list(users_dict.values())
-        users.sort(key=lambda x: x[3], reverse=True)
-        context['users'] = users
-        context['num_users'] = len(users)
-        context['num_schedules'] = len(schedules)
-        context['num_past_schedules'] = len(past_schedules)
-        context['num_logs'] = len(logs)
-        context['is_admin'] = self.request.user.email in ADMIN
+        context['num_users'] = context['paginator'].count
+        context['num_schedules'] = Schedule.objects.filter(
+            date__gte=today).count()
+        context['num_past_schedules'] = Schedule.objects.filter(
+            date__lt=today).count()
+        context['num_logs'] = Log.objects.count()
+        context['export_form'] = ExportForm()
         return context
+
+
+class Export(LoginRequiredMixin, generic.View):
+    """ 予約か操作ログを CSV・Excel で書き出す（管理者のみ） """
+
+    def dispatch(self, request, *args, **kwargs):
+        if request.user.is_authenticated and not roles.is_admin(request):
+            raise Http404
+        return super().dispatch(request, *args, **kwargs)
+
+    def get(self, request, *args, **kwargs):
+        form = ExportForm(request.GET)
+        if not form.is_valid():
+            return HttpResponseBadRequest(form.errors.as_text())
+        data = form.cleaned_data
+        kind, format = data['kind'], data['format']
+        rows = export.rows(kind, start=data['start'], end=data['end'],
+                           faculty=data['faculty'], room=data['room'])
+        response = StreamingHttpResponse(
+            export.write(kind, format, rows),
+            content_type=export.CONTENT_TYPES[format])
+        response['Content-Disposition'] = 'attachment; filename="%s"' % \
+            export.filename(kind, format)
+        return response
+
+
+class Timings(LoginRequiredMixin, generic.TemplateView):
+    """ TimingMiddleware が集計したエンドポイントごとの処理時間（管理者のみ） """
+    template_name = 'room/timings.html'
+
+    def dispatch(self, request, *args, **kwargs):
+        if request.user.is_authenticated and not roles.is_admin(request):
+            raise Http404
+        return super().dispatch(request, *args, **kwargs)
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        context['enabled'] = settings.ROOM_TIMING_ENABLED
+        context['stats'] = timing.endpoint_stats()
+        return context
+
+    def post(self, request, *args, **kwargs):
+        timing.reset()
+        messages.success(request, "集計をリセットしました")
+        return redirect('room:timings')
+
+
+class AvailabilityAPI(LoginRequiredMixin, generic.View):
+    """ 空き状況の JSON。
+
+    HTML のページと同じキャッシュを使い、キャッシュのキー（各日の予約状況の
+    バージョン）から ETag を作る。予約状況が変わっていなければ 304 を返す。
+    """
+
+    def get(self, request, *args, **kwargs):
+        key, build = self.get_payload()
+        etag = '"%s"' % hashlib.sha1(key.encode()).hexdigest()
+        response = get_conditional_response(request, etag=etag)
+        if response is None:
+            response = JsonResponse(
+                build(), json_dumps_params={'ensure_ascii': False})
+        response['ETag'] = etag
+        response['Cache-Control'] = 'private, no-cache'
+        return response
+
+    def get_date(self):
+        return get_date(self.kwargs.get('year'), self.kwargs['month'],
+                        self.kwargs['day'])
+
+
+class WeekAvailabilityAPI(AvailabilityAPI):
+
+    def get_payload(self):
+        today = datetime.date.today()
+        base_date = self.get_date() if 'month' in self.kwargs else today
+        days = [base_date + datetime.timedelta(days=day) for day in range(7)]
+        key = cache.versioned_key('calendar', days, days[0], today)
+
+        def build():
+            calendar = cache.get_or_build(
+                key, lambda: build_calendar(days, today))
+            return {
+                'start': days[0],
+                'end': days[-1],
+                'days': [{
+                    'date': day,
+                    'periods': {
+                        period: {
+                            'available': calendar[period][day][0],
+                            'booked': calendar[period][day][1],
+                            'closed': calendar[period][day][2],
+                        } for period in calendar
+                    },
+                } for day in days],
+            }
+        return key, build
+
+
+class DayAvailabilityAPI(AvailabilityAPI):
+
+    def get_payload(self):
+        date = self.get_date()
+        today = datetime.date.today()
+        key = cache.versioned_key('day', [date], date)
+
+        def build():
+            payload = cache.get_or_build(key, lambda: build_day(date))
+            schedules = payload['schedules_set']
+            return {
+                'date': date,
+                'bookable': date > today and is_available(date),
+                'rooms': [{
+                    'id': room.id,
+                    'name': room.name,
+                    'capacity': room.capacity,
+                    'periods': [{
+                        'period': period,
+                        'unit': cell.unit_id if cell in schedules else cell.id,
+                        'booked': cell in schedules,
+                    } if cell else None for period, cell in enumerate(cells, 1)],
+                } for room, cells in payload['rooms'].items()],
+            }
+        return key + ':' + str(today), build
+
+
+class SlotAvailabilityAPI(AvailabilityAPI):
+
+    def get_payload(self):
+        date = self.get_date()
+        period = self.kwargs['period']
+        today = datetime.date.today()
+        if (date <= today or not is_available(date)) and \
+                not roles.is_admin(self.request):
+            raise Http404
+        key = cache.versioned_key('unit', [date], date, period, today)
+
+        def build():
+            payload = cache.get_or_build(
+                key, lambda: build_unit(date, period))
+            return {
+                'date': date,
+                'period': period,
+                'available': [unit_json(unit) for unit in payload['units']],
+                'booked': [unit_json(schedule.unit)
+                           for schedule in payload['schedules']],
+            }
+        return key, build
+
+
+def unit_json(unit):
+    return {
+        'unit': unit.id,
+        'room': unit.room.id,
+        'name': unit.room.name,
+        'capacity': unit.room.capacity,
+    }
+
+
+class RoomSearchAPI(LoginRequiredMixin, generic.View):
+    """ 期間・時限・収容人数を指定して空き教室を探す。
+
+    ?start=YYYY-MM-DD&end=YYYY-MM-DD&period=1&period=2&capacity=50
+    """
+
+    def get(self, request, *args, **kwargs):
+        try:
+            start = datetime.date.fromisoformat(request.GET['start'])
+            end = datetime.date.fromisoformat(request.GET.get('end', start.isoformat()))
+            periods = [int(period) for period in request.GET.getlist('period')]
+            capacity = int(request.GET.get('capacity', 0))
+        except (KeyError, ValueError):
+            return JsonResponse({'error': 'invalid parameters'}, status=400)
+        if end < start or (end - start).days >= settings.ROOM_ENGINE_DAYS:
+            return JsonResponse({'error': 'invalid date range'}, status=400)
+
+        dates = [start + datetime.timedelta(days=day)
+                 for day in range((end - start).days + 1)]
+        results = engine.get_engine(start, end).search(dates, periods, capacity)
+        units = catalog.get_catalog().units
+        # 予約期間の表は1回だけ引き、結果ごとには日付で引くだけにする
+        booking_windows = windows.get_windows()
+        today = datetime.date.today()
+        return JsonResponse({'results': [{
+            'date': date,
+            'period': period,
+            'bookable': date > today and booking_windows.is_open(date),
+            'rooms': [unit_json(units[unit_id]) for unit_id in unit_ids],
+        } for (date, period), unit_ids in sorted(results.items())]},
+            json_dumps_params={'ensure_ascii': False})
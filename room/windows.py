@@ -0,0 +1,102 @@
+import datetime
+import threading
+
+from django.conf import settings
+
+from . import cache, routers
+from .models import BookingPhase
+
+# 予約できる日付（予約期間）。
+# 学期（Term）と受付の段階（BookingPhase）を、今日の時点で開いている日付の表に
+# 組み立てておき、日付ごとの判定は表を引くだけにする。
+# 表はプロセスごとに持ち、期間の設定が変わるか日付が変わったら組み立て直す。
+# 年を省いた URL（/day/6/21/ など）は、今の学期の年として扱う（current_year()）。
+
+_lock = threading.Lock()
+_current = None
+
+
+class Windows:
+    """ today の時点で予約できる日付の表 """
+
+    def __init__(self, phases, today):
+        dates = set()
+        rules = {}
+        for phase in phases:
+            if phase.opens_on is not None and today < phase.opens_on:
+                continue
+            if phase.closes_on is not None and today > phase.closes_on:
+                continue
+            date = max(phase.first_date or phase.term.first_date, phase.term.first_date)
+            last = min(phase.last_date or phase.term.last_date, phase.term.last_date)
+            while date <= last:
+                if not phase.faculty and phase.room_id is None:
+                    dates.add(date)
+                else:
+                    rules.setdefault(date, []).append((phase.faculty, phase.room_id))
+                date += datetime.timedelta(days=1)
+        self.today = today
+        self.year = term_year({phase.term for phase in phases}, today)
+        # 誰でも予約できる日付
+        self.dates = frozenset(dates)
+        # 一部の学部・教室だけが予約できる日付と、その (学部, 教室の id)
+        self.rules = {date: tuple(date_rules) for date, date_rules in rules.items()
+                      if date not in self.dates}
+
+    def is_open(self, date, room=None, faculty=None):
+        """ date を予約できるかどうか。
+
+        room（教室の id）や faculty を省略すると、その条件で絞り込まない。
+        一覧のページでは省略し、予約するときに教室と学部を指定して確かめる。
+        """
+        if date in self.dates:
+            return True
+        for rule_faculty, rule_room in self.rules.get(date, ()):
+            if faculty is not None and rule_faculty and rule_faculty != faculty:
+                continue
+            if room is not None and rule_room is not None and rule_room != room:
+                continue
+            return True
+        return False
+
+
+def term_year(terms, today):
+    """ 今日を含む学期、なければ次の学期、それもなければ最後の学期の年 """
+    for term in sorted(terms, key=lambda term: term.first_date):
+        if term.first_date <= today <= term.last_date:
+            return today.year
+        if today < term.first_date:
+            return term.first_date.year
+    if terms:
+        return max(term.last_date for term in terms).year
+    return settings.ROOM_YEAR
+
+
+def get_windows():
+    """ 今日の時点の Windows を返す。設定が変わっていれば読み込み直す """
+    global _current
+    version = cache.get_versions([cache.WINDOWS])[0]
+    today = datetime.date.today()
+    current = _current
+    if current is None or current[:2] != (version, today):
+        with _lock:
+            if _current is None or _current[:2] != (version, today):
+                # 遅れているレプリカから読むと、古い期間が新しいバージョンのまま残ってしまう
+                with routers.primary():
+                    phases = list(BookingPhase.objects.select_related('term'))
+                _current = (version, today, Windows(phases, today))
+            current = _current
+    return current[2]
+
+
+def is_available(date, room=None, faculty=None):
+    return get_windows().is_open(date, room=room, faculty=faculty)
+
+
+def current_year():
+    return get_windows().year
+
+
+def invalidate():
+    global _current
+    _current = None
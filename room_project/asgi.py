@@ -9,8 +9,27 @@ https://docs.djangoproject.com/en/3.1/howto/deployment/asgi/
 
 import os
 
-from django.core.asgi import get_asgi_application
+import django
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'room_project.settings')
+# 予約状況を表示するだけのページは非同期版で処理する（room/async_views.py）
+os.environ.setdefault('ROOM_ASYNC_VIEWS', 'True')
+# 予約状況の変化をページに送る（room/events.py）
+os.environ.setdefault('ROOM_EVENTS_ENABLED', 'True')
 
-application = get_asgi_application()
+django.setup(set_prefix=False)
+
+from django.conf import settings  # noqa: E402
+from room import events  # noqa: E402
+from room.handlers import ASGIHandler  # noqa: E402
+
+# get_asgi_application() と同じだが、ストリーミングの中身をスレッドで作るハンドラを使う
+django_application = ASGIHandler()
+
+
+async def application(scope, receive, send):
+    # イベントの購読は長く続く接続なので、Django のハンドラを通さずに扱う
+    if scope['type'] == 'http' and scope['path'] == settings.ROOM_EVENTS_PATH:
+        await events.stream(scope, receive, send)
+    else:
+        await django_application(scope, receive, send)
@@ -56,13 +56,16 @@ INSTALLED_APPS = [
 
 MIDDLEWARE = [
     'django.middleware.security.SecurityMiddleware',
+    'room.middleware.TimingMiddleware',
+    'room.middleware.AdmissionMiddleware',
+    'room.middleware.ReplicaMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
-    'whitenoise.middleware.WhiteNoiseMiddleware',
+    'room.middleware.StaticFilesMiddleware',
 ]
 
 ROOT_URLCONF = 'room_project.urls'
@@ -73,13 +76,24 @@ TEMPLATES = [
         'DIRS': [
             os.path.join(BASE_DIR, 'templates')
         ],
-        'APP_DIRS': True,
         'OPTIONS': {
+            # 本番ではテンプレートを一度だけ読み込んでコンパイル済みのものを使い回す
+            'loaders': [
+                'django.template.loaders.filesystem.Loader',
+                'django.template.loaders.app_directories.Loader',
+            ] if DEBUG else [
+                ('django.template.loaders.cached.Loader', [
+                    'django.template.loaders.filesystem.Loader',
+                    'django.template.loaders.app_directories.Loader',
+                ]),
+            ],
             'context_processors': [
                 'django.template.context_processors.debug',
                 'django.template.context_processors.request',
                 'django.contrib.auth.context_processors.auth',
                 'django.contrib.messages.context_processors.messages',
+                'room.context_processors.role',
+                'room.context_processors.events',
             ],
         },
     },
@@ -99,8 +113,119 @@ DATABASES = {
         'PASSWORD': env('DB_PASSWORD'),
         'HOST': 'localhost',
         'PORT': '',
+        # 接続を使い回す秒数（0 ならリクエストごとに接続し直す）
+        'CONN_MAX_AGE': env.int('DB_CONN_MAX_AGE', default=60),
     }
 }
+# 読み取り専用のレプリカ。DB_REPLICA_HOST を指定すると、ROOM_DB_REPLICA_VIEWS の
+# ビューの読み取りをそちらに送る（room.routers）。テストではプライマリをそのまま使う
+if env('DB_REPLICA_HOST', default=None):
+    DATABASES['replica'] = dict(
+        DATABASES['default'],
+        HOST=env('DB_REPLICA_HOST'),
+        PORT=env('DB_REPLICA_PORT', default=''),
+        TEST={'MIRROR': 'default'},
+    )
+DATABASE_ROUTERS = ['room.routers.ReplicaRouter']
+ROOM_DB_REPLICA = 'replica'
+ROOM_DB_REPLICA_VIEWS = [
+    'room:calendar', 'room:term', 'room:day', 'room:room', 'room:users',
+    'room:user_page', 'room:export',
+]
+# 書き込んだ人の読み取りをプライマリに固定しておく秒数
+ROOM_DB_PIN_SECONDS = env.int('ROOM_DB_PIN_SECONDS', default=5)
+
+CACHES = {
+    'default': env.cache('CACHE_URL', default='locmemcache://'),
+}
+
+# セッションはキャッシュから読み、DB にも書いておく（キャッシュから消えても DB から読み直せる）
+SESSION_ENGINE = 'django.contrib.sessions.backends.cached_db'
+
+# 管理者として扱うユーザ。メールアドレスで指定するか、グループに入れる
+ROOM_ADMIN_EMAILS = env.list(
+    'ROOM_ADMIN_EMAILS', default=['admin1@keio.jp', 'admin2@keio.jp'])
+ROOM_ADMIN_GROUP = env('ROOM_ADMIN_GROUP', default=None)
+
+# 月日だけの URL（/calendar/6/21/ など）を、予約期間（Term）が1つもないときにどの年として扱うか
+ROOM_YEAR = env.int('ROOM_YEAR', default=2021)
+# 期間指定のカレンダー（/term/）で一度に表示できる最大日数
+ROOM_TERM_MAX_DAYS = env.int('ROOM_TERM_MAX_DAYS', default=200)
+
+# Calendar・ScheduleInDay・RoomsInUnit を非同期版にする。asgi.py から起動すると有効になる
+ROOM_ASYNC_VIEWS = env.bool('ROOM_ASYNC_VIEWS', default=False)
+
+# 予約状況の変化をページに送る（room.events）。ASGI で動かすときだけ使える。asgi.py から起動すると有効になる
+ROOM_EVENTS_ENABLED = env.bool('ROOM_EVENTS_ENABLED', default=False)
+ROOM_EVENTS_PATH = '/events/'
+# ASGI のワーカーが複数あるときは room.events.CacheBroker にして CACHE_URL で共有する
+ROOM_EVENTS_BROKER = env('ROOM_EVENTS_BROKER', default='room.events.LocalBroker')
+# 何も起きなくても接続を保つために送る間隔（秒）
+ROOM_EVENTS_KEEPALIVE = env.float('ROOM_EVENTS_KEEPALIVE', default=15.0)
+# CacheBroker が新しいイベントを読みに行く間隔（秒）
+ROOM_EVENTS_POLL_INTERVAL = env.float('ROOM_EVENTS_POLL_INTERVAL', default=1.0)
+
+# 予約状況ページのキャッシュ保持時間（秒）。無効化は日付ごとのバージョンで行う
+ROOM_CACHE_TIMEOUT = env.int('ROOM_CACHE_TIMEOUT', default=60 * 60)
+
+# 予約開始時のアクセス集中に備えた待合室（room.middleware.AdmissionMiddleware）
+ROOM_ADMISSION_ENABLED = env.bool('ROOM_ADMISSION_ENABLED', default=False)
+# 同時に入場できる人数
+ROOM_ADMISSION_LIMIT = env.int('ROOM_ADMISSION_LIMIT', default=200)
+# 入場後、予約のフォーム（ROOM_ADMISSION_FORM_PATHS）を開いたまま枠を保持する秒数
+ROOM_ADMISSION_TIMEOUT = env.int('ROOM_ADMISSION_TIMEOUT', default=5 * 60)
+# 予約状況を見ているだけの人の枠を、操作がないまま保持する秒数
+ROOM_ADMISSION_IDLE_TIMEOUT = env.int('ROOM_ADMISSION_IDLE_TIMEOUT', default=60)
+# 待機ページの自動更新間隔（秒）
+ROOM_ADMISSION_RETRY = env.int('ROOM_ADMISSION_RETRY', default=5)
+ROOM_ADMISSION_PATHS = ['/calendar/', '/term/', '/day/', '/room/', '/booking/']
+ROOM_ADMISSION_FORM_PATHS = ['/booking/']
+
+# リクエストごとのクエリ数と処理時間の計測（room.middleware.TimingMiddleware）
+ROOM_TIMING_ENABLED = env.bool('ROOM_TIMING_ENABLED', default=False)
+# この時間（ミリ秒）を超えたリクエストは warning でログに出す
+ROOM_TIMING_SLOW_MS = env.float('ROOM_TIMING_SLOW_MS', default=500.0)
+# 1リクエストで同じ SQL がこの回数以上発行されたら N+1 とみなす
+ROOM_TIMING_DUPLICATE_THRESHOLD = env.int('ROOM_TIMING_DUPLICATE_THRESHOLD', default=3)
+
+# room 以下のログ（計測結果や操作ログの書き込み失敗など）は標準エラーに出す
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {
+        'console': {'class': 'logging.StreamHandler'},
+    },
+    'loggers': {
+        'room': {'handlers': ['console'], 'level': 'INFO'},
+    },
+}
+
+# 一人あたりの予約数の上限と、上限の対象になる予約の日付の範囲（未指定なら全期間）
+ROOM_BOOKING_LIMIT = env.int('ROOM_BOOKING_LIMIT', default=2)
+ROOM_QUOTA_START = env('ROOM_QUOTA_START',
+                       cast=datetime.date.fromisoformat, default=None)
+ROOM_QUOTA_END = env('ROOM_QUOTA_END',
+                     cast=datetime.date.fromisoformat, default=None)
+
+# 空き教室検索（room.engine）が予約状況を保持する期間。開始日の指定がなければ起動日から
+ROOM_ENGINE_START = env('ROOM_ENGINE_START',
+                        cast=datetime.date.fromisoformat, default=None)
+ROOM_ENGINE_DAYS = env.int('ROOM_ENGINE_DAYS', default=200)
+
+# 予約・操作ログの書き出し（room.export）で一度に DB から読み、まとめて送る行数
+ROOM_EXPORT_CHUNK_SIZE = env.int('ROOM_EXPORT_CHUNK_SIZE', default=2000)
+
+# 操作ログ（room.audit）の書き込み。無効にするとリクエスト中に1件ずつ保存する
+ROOM_AUDIT_ASYNC = env.bool('ROOM_AUDIT_ASYNC', default=True)
+ROOM_AUDIT_BATCH_SIZE = env.int('ROOM_AUDIT_BATCH_SIZE', default=100)
+# バッファを書き込む間隔（秒）
+ROOM_AUDIT_FLUSH_INTERVAL = env.float('ROOM_AUDIT_FLUSH_INTERVAL', default=2.0)
+# DB に書けなかったログの退避先
+ROOM_AUDIT_SPOOL = env('ROOM_AUDIT_SPOOL',
+                       default=str(BASE_DIR.joinpath('audit_spool.jsonl')))
+# 保存できなかった（消されたユーザや時間割を指す）ログの移し先
+ROOM_AUDIT_DEAD_LETTER = env('ROOM_AUDIT_DEAD_LETTER',
+                             default=str(BASE_DIR.joinpath('audit_spool.jsonl.failed')))
 
 
 # Password validation
@@ -150,9 +275,10 @@ STATICFILES_FINDERS = [
 ]
 STATICFILES_STORAGE = 'whitenoise.storage.CompressedManifestStaticFilesStorage'
 
+# ログイン中のユーザはキャッシュから読む（room.backends）
 AUTHENTICATION_BACKENDS = [
-    'django.contrib.auth.backends.ModelBackend',
-    'allauth.account.auth_backends.AuthenticationBackend'
+    'room.backends.ModelBackend',
+    'room.backends.AuthenticationBackend'
 ]
 
 SOCIALACCOUNT_PROVIDERS = {
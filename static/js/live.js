@@ -0,0 +1,80 @@
+// 予約状況が変わったら、ページの id="live" の中の変わった時間割の部分だけを読み直す。
+// data-events の URL（room/events.py）をサーバ送信イベントで購読し、届いた時間割の
+// 部分を data-slot の URL（?unit=<id>）から読んで、同じ data-unit の要素と差し替える。
+// 要素に data-list があれば、その id の一覧に移す
+(function () {
+    var live = document.getElementById('live');
+    if (!live || !live.dataset.events || !window.EventSource) {
+        return;
+    }
+    var pending = {};
+
+    function fetchText(url) {
+        return fetch(url, { credentials: 'same-origin' })
+            .then(function (response) {
+                if (!response.ok) {
+                    throw new Error(response.status);
+                }
+                return response.text();
+            });
+    }
+
+    // 目印のない古い表のときは、これまでどおり全体を読み直す
+    function reload() {
+        fetchText(window.location.href)
+            .then(function (html) {
+                var page = new DOMParser().parseFromString(html, 'text/html');
+                var fresh = page.getElementById('live');
+                if (fresh) {
+                    live.innerHTML = fresh.innerHTML;
+                }
+            })
+            .catch(function () {});
+    }
+
+    function update(unit) {
+        var url = live.dataset.slot + '?unit=' + encodeURIComponent(unit);
+        fetchText(url)
+            .then(function (html) {
+                var template = document.createElement('template');
+                template.innerHTML = html.trim();
+                var fresh = template.content.firstElementChild;
+                var old = live.querySelector('[data-unit="' + unit + '"]');
+                var list = fresh && fresh.dataset.list &&
+                    document.getElementById(fresh.dataset.list);
+                if (list) {
+                    if (old) {
+                        old.remove();
+                    }
+                    var empty = list.querySelector('.empty');
+                    if (empty) {
+                        empty.remove();
+                    }
+                    list.appendChild(fresh);
+                } else if (fresh && old) {
+                    old.replaceWith(fresh);
+                } else if (old && old.dataset.list) {
+                    old.remove();
+                }
+            })
+            .catch(function () {});
+    }
+
+    var source = new EventSource(live.dataset.events);
+    source.addEventListener('slot', function (event) {
+        var unit = JSON.parse(event.data).unit;
+        if (!live.dataset.slot || !live.querySelector('[data-unit]')) {
+            clearTimeout(pending.page);
+            pending.page = setTimeout(reload, 200 + Math.random() * 800);
+            return;
+        }
+        // 同じ時間割に続けて届いたものはまとめ、全員が同時に読まないよう少しずらす
+        if (pending[unit]) {
+            return;
+        }
+        pending[unit] = setTimeout(function () {
+            delete pending[unit];
+            update(unit);
+        }, 100 + Math.random() * 400);
+    });
+})();